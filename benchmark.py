@@ -0,0 +1,134 @@
+"""
+Headless benchmark of the port assignment and layout pipeline.
+
+Runs rounding, matching, ILP port assignment (cold, and again from its own solution: from scratch with
+and without it as hint, and reusing the model), the layout LP and the label overlap fix on every network
+in loom-examples/ (or the given files) and writes the timings, model sizes and peak memory of every
+stage to a JSON file, so that two commits can be compared by diffing their results:
+
+    python benchmark.py -o before.json
+    python benchmark.py loom-examples/wien.json loom-examples/berlin.json -o after.json
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tracemalloc
+from time import perf_counter
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+from PySide6.QtWidgets import QApplication
+
+from elements.network import Network
+from io_management.fileformat_loom import read_network_from_loom
+from io_management.fileformat_mooey import read_mooey_file
+import helpers.port_assign as port_assign
+import helpers.layout as layout
+import helpers.stats as stats
+
+# Same settings as the canvas
+min_edge_scale = 80
+label_dist = 25
+
+def load( file_name: str ) -> Network:
+    if file_name.endswith('.mooey'): net = read_mooey_file(file_name)
+    else: net, _ = read_network_from_loom(file_name)
+    net.scale_by_shortest_edge( min_edge_scale )
+    net.find_degree_2_lines()
+    net.calculate_mid_point()
+    net.find_min_max_geo()
+    net.divide_in_lines()
+    return net
+
+# (stage, name of its model in helpers.stats, function of the network)
+# Rounding and matching run on a clone: the ILP should start from the ports in the file (locked nodes keep theirs)
+stages = [ ('rounding', None, lambda net: port_assign.assign_by_rounding(net.clone()))
+         , ('matching', None, lambda net: port_assign.assign_by_local_matching(net.clone()))
+         , ('ilp', 'pa-ilp', port_assign.assign_by_ilp)
+         # Solving again from the optimum, as after a slider tick: without and with the current ports as hint
+         , ('ilp-resolve', 'pa-ilp', lambda net: port_assign.assign_by_ilp(net.clone(), hint=False))
+         , ('ilp-hinted', 'pa-ilp', lambda net: port_assign.assign_by_ilp(net.clone(), hint=True))
+         # and on the network itself, which keeps its model and only updates the objective
+         , ('ilp-reuse', 'pa-ilp', port_assign.assign_by_ilp)
+         , ('layout', 'layout', lambda net: layout.layout_lp(net, label_dist))
+         , ('overlap', 'plf-ilp', lambda net: port_assign.post_fix_overlap_ilp_new(net, label_dist)) ]
+
+def run_pipeline( file_name: str, memory: bool ) -> dict:
+    # Every stage on a freshly loaded network; with memory, the peak of the Python heap
+    # (tracemalloc does not see the solvers' own allocations, and slows everything down)
+    net = load(file_name)
+    results = dict()
+    for stage, model, run in stages:
+        if stage == 'overlap' and not net.layout_set:
+            results[stage] = dict(error='no layout')
+            continue
+        stats.models.pop(model, None)
+        if memory:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        start = perf_counter()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                returned = run(net)
+        except Exception as exception:
+            results[stage] = dict(error=repr(exception))
+            continue
+        result = dict(time=perf_counter()-start)
+        if memory: result['peak_memory'] = tracemalloc.get_traced_memory()[1]-base
+        if stage == 'layout' and returned is False: result['error'] = 'layout failed'
+        result.update(stats.models.get(model, {}))
+        results[stage] = result
+    return results
+
+def benchmark( file_name: str, memory: bool ) -> dict:
+    try:
+        net = load(file_name)
+    except Exception as exception:
+        return dict(error=repr(exception), stages=dict())
+    result = dict(nodes=len(net.nodes), edges=len(net.edges), stages=run_pipeline(file_name, False))
+    if memory:
+        tracemalloc.start()
+        for stage, measured in run_pipeline(file_name, True).items():
+            if 'peak_memory' in measured: result['stages'][stage]['peak_memory'] = measured['peak_memory']
+        tracemalloc.stop()
+    return result
+
+def commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark port assignment and layout on example networks")
+    parser.add_argument('files', nargs='*', help="networks to run (default: all .json and .mooey files in loom-examples/)")
+    parser.add_argument('-o', '--output', default='benchmark.json', help="results file (default: benchmark.json)")
+    parser.add_argument('--no-memory', action='store_true', help="skip the (slow) second run that measures peak memory")
+    parser.add_argument('--backend', choices=port_assign.backends, default=port_assign.default_backend, help="solver of the port assignment ILPs")
+    parser.add_argument('--layout-backend', choices=layout.backends, default=layout.default_backend, help="solver of the layout LP")
+    parser.add_argument('--time-limit', type=float, default=None, help="wall-clock budget of each port assignment ILP in seconds (default: none, solve to optimality)")
+    args = parser.parse_args()
+    port_assign.default_backend = args.backend
+    port_assign.ilp_time_limit = args.time_limit
+    layout.default_backend = args.layout_backend
+
+    files = args.files or sorted(glob.glob('loom-examples/*.json') + glob.glob('loom-examples/*.mooey'))
+    app = QApplication.instance() or QApplication(sys.argv)
+    # Cold solves only: the cache would serve the second run of a network
+    layout.layout_cache.max_bytes = 0
+
+    results = dict()
+    for file_name in files:
+        results[os.path.basename(file_name)] = benchmark(file_name, not args.no_memory)
+        for stage, result in results[os.path.basename(file_name)]['stages'].items():
+            print( "bench\t" + os.path.basename(file_name) + "\t" + stage + "\t" + str(result.get('time', result.get('error'))) )
+
+    with open(args.output, 'w') as f:
+        json.dump(dict(commit=commit(), python=platform.python_version(), machine=platform.machine()
+                      , cpus=os.cpu_count(), backend=args.backend, layout_backend=args.layout_backend, time_limit=args.time_limit, results=results), f, indent=2, sort_keys=True)
+    print( "bench\tResults written to\t" + args.output )
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from PySide6.QtCore import QObject, Signal
+
+from elements.network import Network
+import helpers.port_assign as port_assign
+
+class AnytimeJob:
+    """
+    One anytime port assignment on the model kept alive by the network (see assign_by_ilp). The model
+    is prepared on the GUI thread when the job starts, the ILP is solved on a worker thread, and every
+    improving assignment is put on the network on the GUI thread. A running job owns the model until it
+    is done, a port assignment in the meantime builds a model of its own.
+    """
+
+    def __init__(self, net: Network):
+        self.net: Network = net
+        self.model: port_assign.PortAssignmentModel | None = None
+        self.generation: int = 0
+        self.stopped: bool = False
+        self.solution = None
+        self.objective: float | None = None
+        self.gap: float | None = None
+        self.improvements: int = 0
+        self.status: int | None = None
+        self.start = perf_counter()
+
+    def prepare(self):
+        # On the GUI thread, right before the job runs
+        net = self.net
+        backend = port_assign.default_backend
+        if net.port_model is None or not net.port_model.fits(net, backend) or net.port_model.solving:
+            net.port_model = port_assign.PortAssignmentModel(net, backend)
+        self.model = net.port_model
+        self.model.solving = True
+        self.model.prepare(hint=True)
+
+    def stop(self):
+        # Keep the best assignment so far: no new round, and the running one ends now
+        self.stopped = True
+        if self.model is not None: self.model.interrupt()
+
+    def release(self):
+        self.model.solving = False
+
+    def fits(self) -> bool:
+        # The assignments only fit the network as long as it has the same nodes and edges
+        return self.model.fits(self.net, self.model.backend)
+
+class AnytimePortAssignment(QObject):
+    """
+    Runs the port assignment ILP on a worker thread and shows every better assignment it finds on the way
+    (see port_assign.ilp_anytime), so a large map does not stay blank until the ILP is done.
+
+    At most one search runs at a time. A new request stops the running one, whose assignments are not shown
+    anymore, and starts once it has ended: both use the same model. accept stops the search at the best
+    assignment so far. The improved and finished signals are emitted on the GUI thread, after the
+    assignment has been put on the network.
+    """
+    improved = Signal(object)
+    finished = Signal(object)
+    found = Signal(object, object, float, object) # from the worker thread
+    solved = Signal(object) # from the worker thread
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.generation: int = 0
+        self.running: AnytimeJob | None = None
+        self.pending: AnytimeJob | None = None
+        self.idle_callbacks: list = []
+
+        self.found.connect(self.handle_found)
+        self.solved.connect(self.handle_solved)
+
+    def request(self, net: Network):
+        self.generation += 1
+        job = AnytimeJob(net)
+        job.generation = self.generation
+        if self.running is None: self.start(job)
+        else:
+            self.running.stop()
+            self.pending = job
+
+    def accept(self):
+        if self.running is not None: self.running.stop()
+
+    def busy(self) -> bool:
+        return self.running is not None or self.pending is not None
+
+    def after_idle(self, callback):
+        # Call back once no search is running or waiting anymore
+        if self.busy(): self.idle_callbacks.append(callback)
+        else: callback()
+
+    def start(self, job: AnytimeJob):
+        self.running = job
+        job.prepare()
+        self.executor.submit(self.run, job)
+
+    def run(self, job: AnytimeJob):
+        try:
+            job.status = port_assign.ilp_anytime( job.model
+                , lambda solution, objective, gap: self.found.emit(job, solution, objective, gap)
+                , lambda: job.stopped )
+        except Exception as exception:
+            print( "stats\tanytime port assignment raised " + repr(exception) )
+            job.status = -1
+        self.solved.emit(job)
+
+    def handle_found(self, job: AnytimeJob, solution, objective: float, gap):
+        if job.generation != self.generation or not job.fits(): return
+        job.model.assign(solution)
+        job.solution, job.objective, job.gap = solution, objective, gap
+        job.improvements += 1
+        print( "pa-ilp\tAnytime port assignment improved to\t" + str(objective) + "\tat (s)\t" + str(perf_counter()-job.start) )
+        self.improved.emit(job)
+
+    def handle_solved(self, job: AnytimeJob):
+        self.running = None
+        job.release()
+        if job.generation == self.generation:
+            print( "pa-ilp\tAnytime port assignment finished with status\t" + str(job.status) + "\tafter (s)\t" + str(perf_counter()-job.start) )
+            self.finished.emit(job)
+
+        if self.pending is not None:
+            job, self.pending = self.pending, None
+            self.start(job)
+        else:
+            callbacks, self.idle_callbacks = self.idle_callbacks, []
+            for callback in callbacks: callback()
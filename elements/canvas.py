@@ -8,11 +8,12 @@ from io_management.fileformat_loom import read_network_from_loom, export_loom, r
 from io_management.fileformat_graphml import read_network_from_graphml
 from io_management.fileformat_mooey import write_mooey_file, read_mooey_file, get_unique_filename
 
-from helpers.layout import layout_lp
+from helpers.layout import layout_lp, reuse_layout, place_labels, region_hops
 import helpers.port_assign as pa
 
 from elements.network import Label, Node, Edge, Network
 from elements.group import Group
+from elements.layout_service import LayoutService, LayoutJob
 
 import random
 import pickle
@@ -85,6 +86,10 @@ class Canvas(QWidget):
         # 0 = square, 1 = lasso, 2 = brush, 3 = line 
         self.selection_mode: int = 1
         self.color_selected: None | str = None 
+
+        # Solves layouts off the GUI thread (if self.background_layout is checked)
+        self.layout_service = LayoutService(self)
+        self.layout_service.finished.connect(self.handle_layout_finished)
         
     def render(self):
         #self.network.clone()
@@ -166,7 +171,7 @@ class Canvas(QWidget):
             nodes = self.network.lines[color]
 
             # Create a group 
-            self.groups[color] = Group(nodes, name=color, color=f'#{color}')
+            self.groups[color] = Group(nodes, name=color, color=f'#{color}', chains=self.network.chains)
 
 
     # Forward every mouse event to the function handle_mouse 
@@ -249,36 +254,13 @@ class Canvas(QWidget):
         if self.network_change is not None:
             self.there_was_change = self.network_change 
             if self.auto_update.isChecked():
-                # this is for calculating the new mouse placement after a shift happened while dragging. 
-                resolve_shift = layout_lp(self.network, self.label_dist, ui.hover_node)
-
-                if self.group: 
-                    self.group.update_group()
-
-                    #### Do we want to move with the button??? 
-                    # if self.group and self.pivot_group != None: 
-                    #     con_button = self.group.con_buttons_pos[self.pivot_group]
-                    #     self.view.translate(self.mouse_pos.x() - con_button.x(), self.mouse_pos.y() - con_button.y())
-
-                # we only translate when we have no dragging, results in more intuitive interaction
-                if resolve_shift and not self.drag: 
-                    self.view.translate(-resolve_shift.x(), -resolve_shift.y())
-                # This is just so the 'drag one node' behaviour works properly again (was removed for some reason)
-                elif self.network_change[0:9] == 'drag node' and ui.drag_node and len(ui.drag_node.edges) != 1 and len(self.affected_nodes) <= 2: 
-                    self.view.translate(self.mouse_pos.x() - ui.drag_node.pos.x(), self.mouse_pos.y() - ui.drag_node.pos.y())
-                if resolve_shift is False:
-                    print('no shift')
-                    m = QMessageBox()
-                    m.setText("Failed to realise layout.")
-                    m.setIcon(QMessageBox.Warning)
-                    m.setStandardButtons(QMessageBox.Ok)
-                    m.exec()
+                if self.background_layout.isChecked(): 
+                    # the result comes in through handle_layout_finished
+                    self.request_layout(ui.hover_node, self.network_change)
                 else: 
-                    if self.auto_render.isChecked():
-                        export_loom(self.network,self.filedata)
-                        render_loom( "render.json", "render.svg" )
-                    if self.show_background.isChecked(): 
-                        self.network.set_background_image()
+                    # this is for calculating the new mouse placement after a shift happened while dragging. 
+                    resolve_shift = layout_lp(self.network, self.label_dist, ui.hover_node, **self.layout_scope())
+                    self.handle_layout_result(resolve_shift, self.network_change)
 
         if release and self.there_was_change:
             self.history_checkpoint( self.there_was_change )
@@ -289,6 +271,114 @@ class Canvas(QWidget):
         self.render()  
     
     
+    def request_layout(self, stable_node: Node = None, change: str | None = None): 
+        """
+        Queues a layout solve in the background, superseding any solve that was requested before. 
+        """
+        if not self.network.ports_set(): 
+            self.layout_service.cancel()
+            self.handle_layout_result(False, change)
+            return 
+        resolve_shift = reuse_layout(self.network, self.label_dist, stable_node, self.fix_locked.isChecked())
+        if resolve_shift is not False: 
+            # Solved this state before or only rescaled, nothing to wait for 
+            self.layout_service.cancel()
+            self.handle_layout_result(resolve_shift, change)
+            self.render()
+            return 
+        self.layout_service.request(LayoutJob(self.network, self.label_dist, stable_node, change, **self.layout_scope()))
+
+    def layout_scope(self) -> dict: 
+        # With local re-layout, only the nodes around the edit (and in the selected group) may move, 
+        # and locked nodes may be kept in place 
+        scope = dict(fix_locked=self.fix_locked.isChecked())
+        if self.local_layout.isChecked(): 
+            scope.update(hops=region_hops, region=self.group.nodes if self.group else None)
+        return scope
+
+    def handle_layout_finished(self, job: LayoutJob): 
+        # The network was replaced (opened file, undo) while solving 
+        if job.net is not self.network: return 
+
+        if job.is_local() and job.status != 0 and (job.scoped or not job.keeps_locked): 
+            # The edit does not fit in the region around it, solve the whole layout instead, 
+            # still with the locked nodes in place if they were 
+            print( "layout\tLocal layout failed with status "+str(job.status)+", solving the whole layout" )
+            self.layout_service.request(LayoutJob(self.network, job.label_dist, job.stable_node, job.change, fix_locked=job.keeps_locked))
+            return 
+        if job.is_local() and job.status != 0: 
+            # The locked nodes cannot stay in place: keep the current layout (see layout_local) 
+            print( "layout\tLayout with the locked nodes in place failed with status "+str(job.status)+", keeping the current layout" )
+            self.handle_layout_result(False, job.change)
+            return 
+
+        resolve_shift = job.apply()
+        if resolve_shift is not False and job.label_dist != self.label_dist: 
+            # The label distance was changed while solving 
+            place_labels(self.network, self.label_dist)
+        if resolve_shift is not False and job.change is None and self.drawing_is_completely_oob():
+            self.zoom_to_network()
+            self.network.set_background_image()
+        self.handle_layout_result(resolve_shift, job.change)
+        self.render()
+
+    def handle_layout_result(self, resolve_shift: QPointF | None | bool, change: str | None): 
+        """
+        Everything that follows a layout solve: updating the group, moving the view along with the 
+        stable node and reporting failures. 
+        """
+        if self.group: 
+            self.group.update_group()
+
+            #### Do we want to move with the button??? 
+            # if self.group and self.pivot_group != None: 
+            #     con_button = self.group.con_buttons_pos[self.pivot_group]
+            #     self.view.translate(self.mouse_pos.x() - con_button.x(), self.mouse_pos.y() - con_button.y())
+
+        # we only translate when we have no dragging, results in more intuitive interaction
+        if resolve_shift and not self.drag: 
+            self.view.translate(-resolve_shift.x(), -resolve_shift.y())
+        # This is just so the 'drag one node' behaviour works properly again (was removed for some reason)
+        elif change is not None and change[0:9] == 'drag node' and ui.drag_node and len(ui.drag_node.edges) != 1 and len(self.affected_nodes) <= 2: 
+            self.view.translate(self.mouse_pos.x() - ui.drag_node.pos.x(), self.mouse_pos.y() - ui.drag_node.pos.y())
+        if resolve_shift is False:
+            print('no shift')
+            m = QMessageBox()
+            m.setText("Failed to realise layout.")
+            if self.fix_locked.isChecked() and any( v.locked for v in self.network.nodes.values() ): 
+                m.setInformativeText("The locked stations cannot all stay in place. Uncheck \"Keep locked stations in place\" to let them move.")
+            m.setIcon(QMessageBox.Warning)
+            m.setStandardButtons(QMessageBox.Ok)
+            m.exec()
+        else: 
+            if self.auto_render.isChecked():
+                export_loom(self.network,self.filedata)
+                render_loom( "render.json", "render.svg" )
+            if self.show_background.isChecked(): 
+                self.network.set_background_image()
+
+    def report_ilp(self, status: int, what: str, gap: float | None = None): 
+        """
+        Tells the user when an ILP was not solved to optimality: within the time limit, the best 
+        solution found so far is used (and may be improved on), otherwise nothing changes. 
+        """
+        if status == pa.lp.Solver.OPTIMAL: return 
+        limit = "" if pa.ilp_time_limit is None else f" within the time limit of {pa.ilp_time_limit:g} s"
+        m = QMessageBox()
+        if pa.solution_found(status): 
+            m.setText(f"The {what} was not solved to optimality{limit}.")
+            m.setInformativeText("The best solution found is used" + ("" if gap is None else f" (optimality gap {100*gap:.1f}%)") 
+                                 + ". A longer time limit (under Port assignment) may improve it.")
+        elif status == pa.lp.Solver.INFEASIBLE: 
+            m.setText(f"The {what} has no solution.")
+        else: 
+            m.setText(f"The {what} found no solution{limit}.")
+            m.setInformativeText("Nothing was changed.")
+        print( "user\t" + m.text() )
+        m.setIcon(QMessageBox.Warning)
+        m.setStandardButtons(QMessageBox.Ok)
+        m.exec()
+
     def handle_currently_hovering(self):
         """
         Determines what UI element the mouse is currently hovering over. Including: nodes, labels and ports (and also edges if they are connected)
@@ -566,7 +656,7 @@ class Canvas(QWidget):
 
             ##### Voor als er in het midden word geklikt 
             if self.group.hover_label_port == 8: 
-                pa.post_fix_overlap_ilp_group(self.network, self.label_dist, self.group)
+                self.report_ilp(pa.post_fix_overlap_ilp_group(self.network, self.label_dist, self.group), "group label ILP")
                 self.group.label_port_active = None
                 self.network_change = f're-assigned group labels via ILP'
             else: 
@@ -701,7 +791,7 @@ class Canvas(QWidget):
         if len(nodes_in_selection) < 1: return 
 
         # Create a group 
-        self.group = Group(nodes_in_selection)
+        self.group = Group(nodes_in_selection, chains=self.network.chains)
 
     def handle_double_click(self): 
         """
@@ -730,6 +820,7 @@ class Canvas(QWidget):
             self.station_added += 1
             edge = add_edge(ui.edge_from, self.network.nodes[station])
             self.network.edges.append(edge)
+            self.network.chains.update(edge.v)
             self.network_change = 'added node and edge'
             ui.edge_from = self.network.nodes[station] 
             ui.hover_node = None 
@@ -975,12 +1066,12 @@ class Canvas(QWidget):
         if selected_group != None and len(selected_group) > 0: 
             nodes = [node for node in self.network.nodes.values() if node.name in selected_group[1:]]
             if len(nodes) > 0: 
-                self.group = Group(nodes, selected_group[0][0], selected_group[0][1], bend=selected_group[0][2], hor=selected_group[0][3], same_side=selected_group[0][4])
+                self.group = Group(nodes, selected_group[0][0], selected_group[0][1], bend=selected_group[0][2], hor=selected_group[0][3], same_side=selected_group[0][4], chains=self.network.chains)
         
         self.groups = {}
         for group in history[3]: 
             nodes = [node for node in self.network.nodes.values() if node.name in group[1:]]
             if len(nodes) > 0: 
-                self.groups[group[0][0]] = Group(nodes, group[0][0], group[0][1],  bend=group[0][2], hor=group[0][3], same_side=group[0][4])
+                self.groups[group[0][0]] = Group(nodes, group[0][0], group[0][1],  bend=group[0][2], hor=group[0][3], same_side=group[0][4], chains=self.network.chains)
        
             
@@ -8,7 +8,7 @@ from shapely.ops import unary_union, polygonize
 
 from collections import deque
 
-from elements.network import Node, Edge, Network
+from elements.network import Node, Edge, Network, ChainIndex
 from math import sqrt
 
 def opposite_port( p ):
@@ -28,8 +28,10 @@ port_offset = [ QPointF(-1,0)
 
 class Group: 
 
-    def __init__(self, nodes: list[Node], name: str = '', color = None, bend=0, hor=0, same_side=0):
+    def __init__(self, nodes: list[Node], name: str = '', color = None, bend=0, hor=0, same_side=0, chains: ChainIndex = None):
         self.nodes: list[Node] = nodes 
+        # Degree 2 paths of the network (walked over the group's nodes if not given)
+        self.chains: ChainIndex | None = chains
         self.conn_edges: list[Edge] = []
         self.conn_nodes: list[Node] = []
         self.pivot_edges: list[Edge] = []
@@ -91,7 +93,7 @@ class Group:
     def clone(self, network: Network) -> Group:
         group_node_names = [group_node.name for group_node in self.nodes]
         new_group_nodes = [v for v in network.nodes.values() if v.name in group_node_names]
-        new_group = Group(new_group_nodes, name=self.name, color=self.color)
+        new_group = Group(new_group_nodes, name=self.name, color=self.color, chains=network.chains)
         new_group.bend_pentalty = self.bend_pentalty
         new_group.label_hor = self.label_hor
         new_group.label_same_side = self.label_same_side
@@ -334,37 +336,10 @@ class Group:
         return self.label_port_active
     
     def find_degree_2_lines(self): 
-        self.deg_2_lines: list[list[Node]] = []
-        seen: dict = dict()
-        for v in self.nodes: 
-            if v in seen: continue
-
-            if v.is_deg2() and len(self.internal[v]) == 2:
-                seen[v] = True 
-
-                path1 = self.spacewalk( self.internal[v][0].other(v), v, seen )
-                path2 = self.spacewalk( self.internal[v][1].other(v), v, seen )
-                walk: list[Node] = path1 + [v] + list(reversed(path2))
-                self.deg_2_lines.append(walk)
-            else: # We skip degree 1 and > 2 because they will be taken into account with one of the walks 
-                continue 
-    
-    def spacewalk(self, v: Node, prev, seen ) -> list[Node]:
-        seen[v] = True
-        walk = []
-
-        if v.is_deg2() and len(self.internal[v]) == 2:
-            v0 = v.edges[0].other(v)
-            v1 = v.edges[1].other(v)
-            next = v0 if v1==prev else v1
-            # We want to add deg 1 and deg > 2 to the walk because they do belong to the part of the metro line
-            if next.is_deg2() and len(self.internal[next]) == 2:
-                if not next in seen:
-                    walk = self.spacewalk( next, v, seen )
-            elif next in self.internal: 
-                walk.append(next)
-        walk.append(v)
-        return walk
+        # The parts of the network's degree 2 paths that run over internal edges only
+        if self.chains is None: self.chains = ChainIndex(self.nodes)
+        inner = lambda v: v.is_deg2() and len(self.internal.get(v, [])) == 2
+        self.deg_2_lines: list[list[Node]] = self.chains.runs(inner, self.nodes)
     
     def amount_internal_edges(self, node: Node): 
         amount = 0 
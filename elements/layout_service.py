@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from PySide6.QtCore import QObject, QPointF, Signal
+
+from elements.network import Node, Network
+import helpers.layout as layout
+from helpers.layout import set_layout, LayoutModel
+from helpers.layout_sparse import network_problem, local_problem, keeps_locked, solve_components
+
+class LayoutJob:
+    """
+    One requested layout solve. The LP is extracted from the network on the GUI thread, only the solve
+    itself runs in the background, and the result is written back on the GUI thread.
+
+    Like layout_lp, a whole layout with the GLOP backend goes through the LP kept alive by the network
+    (LayoutModel), which is updated when the job starts: a running job still owns it until its result
+    is written back. Local re-layouts and the HiGHS backend extract a sparse problem when the job is created.
+    """
+
+    def __init__(self, net: Network, label_dist: int, stable_node: Node = None, change: str | None = None
+                , hops: int | None = None, region: list[Node] | None = None, fix_locked: bool = False):
+        self.net: Network = net
+        self.label_dist: int = label_dist
+        self.stable_node: Node | None = stable_node
+        self.old_stable_pos: QPointF | None = stable_node.pos if stable_node else None
+        # Description of the edit that triggered the solve (None if not triggered from the canvas)
+        self.change: str | None = change
+
+        # A local re-layout (see layout_local) fixes the points outside the edited region and/or the locked ones
+        self.fixed = None
+        self.values = None
+        self.scoped: bool = hops is not None or region is not None
+        self.keeps_locked: bool = keeps_locked(net, fix_locked)
+        self.problem = None
+        self.model: LayoutModel | None = None
+        local = local_problem(net, hops, region, fix_locked) if hops is not None or region is not None or fix_locked else None
+        if local is not None:
+            self.problem, self.fixed, self.values = local
+        elif layout.default_backend == 'highs':
+            self.problem = network_problem(net)
+        self.build: float = 0
+        self.changed: int = 0
+        self.generation: int = 0
+        self.status: int | None = None
+        self.x = None
+        self.start = perf_counter()
+
+    def prepare(self):
+        # On the GUI thread, right before the job runs
+        if self.problem is not None: return
+        net = self.net
+        if net.layout_model is None or net.layout_model.net is not net or net.layout_model.solving:
+            net.layout_model = LayoutModel(net)
+        self.model = net.layout_model
+        self.model.solving = True
+        update = perf_counter()
+        self.changed = self.model.update()
+        self.build = perf_counter()-update
+
+    def run(self):
+        if self.model is not None:
+            self.status = self.model.solver.Solve()
+            return
+        self.status, self.x, _ = solve_components(self.problem, True, self.fixed, self.values)
+
+    def release(self):
+        # The model may be updated by the next job (also when this one is discarded)
+        if self.model is not None: self.model.solving = False
+
+    def is_local(self) -> bool:
+        return self.fixed is not None
+
+    def apply(self):
+        # Same return values as layout_lp
+        if self.model is not None:
+            return self.model.result(self.status, self.start, self.build, self.changed, self.label_dist
+                                    , self.stable_node, self.old_stable_pos)
+        if self.status != 0:
+            for e in self.net.edges:
+                e.bend = None # clear bends
+            return False
+        return set_layout( self.net, self.problem.position(self.x), self.label_dist, self.stable_node, self.old_stable_pos
+                         , optimal=not self.is_local() )
+
+class LayoutService(QObject):
+    """
+    Runs layout solves on a worker thread so the canvas stays responsive.
+
+    At most one solve runs at a time. A new request replaces the pending one, which then never starts,
+    and marks the running one as stale: its result is discarded when it comes in. Only results for the
+    latest request are delivered, through the finished signal, on the GUI thread.
+    """
+    finished = Signal(object)
+    solved = Signal(object) # from the worker thread
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.generation: int = 0
+        self.running: LayoutJob | None = None
+        self.pending: LayoutJob | None = None
+        self.idle_callbacks: list = []
+
+        self.solved.connect(self.handle_solved)
+
+    def request(self, job: LayoutJob):
+        self.generation += 1
+        job.generation = self.generation
+        if self.running is None: self.start(job)
+        else: self.pending = job
+
+    def cancel(self):
+        # Forget about everything that was requested so far
+        self.generation += 1
+        self.pending = None
+
+    def busy(self) -> bool:
+        return self.running is not None or self.pending is not None
+
+    def after_idle(self, callback):
+        # Call back once no solve is running or pending anymore
+        if self.busy(): self.idle_callbacks.append(callback)
+        else: callback()
+
+    def start(self, job: LayoutJob):
+        self.running = job
+        job.prepare()
+        self.executor.submit(self.run, job)
+
+    def run(self, job: LayoutJob):
+        try:
+            job.run()
+        except Exception as exception:
+            print( "stats\tlayout solve raised " + repr(exception) )
+            job.status = -1
+        self.solved.emit(job)
+
+    def handle_solved(self, job: LayoutJob):
+        self.running = None
+        if job.generation == self.generation:
+            print( "layout\tBackground layout runtime (s)\t" + str(perf_counter()-job.start) )
+            self.finished.emit(job)
+        else:
+            print( "layout\tDiscarded superseded layout solve" )
+        job.release()
+
+        if self.pending is not None:
+            job, self.pending = self.pending, None
+            self.start(job)
+        else:
+            callbacks, self.idle_callbacks = self.idle_callbacks, []
+            for callback in callbacks: callback()
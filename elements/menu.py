@@ -9,12 +9,21 @@ from elements.canvas import Canvas
 from elements.network import Node, Network
 from elements.group import Group 
 from elements.bend_dialog import BendPenaltyDialog
+from elements.speculation import SpeculativePool, speculation_radius
+from elements.anytime import AnytimePortAssignment
+from elements.recompute import RecomputeScheduler
 
 import helpers.port_assign as port_assign 
 import helpers.layout as layout
 
 from io_management.fileformat_loom import export_loom, render_loom
 
+# Node attributes set by the sliders of the global (ILP) method, in slider order
+ilp_slider_attributes = ['bend_penalty', 'label_hor', 'label_same_side']
+
+# Choices for the port assignment time limit in seconds (None: solve to optimality)
+ilp_time_limits = [1, 5, 10, 30, None]
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -48,6 +57,14 @@ class MainWindow(QMainWindow):
 
         # --- Right canvas ---
         self.canvas = Canvas(self.history_checkpoint)
+        # Port assignments for slider values next to the current one, computed ahead
+        self.speculation = SpeculativePool(self)
+        # Global port assignment that shows better assignments as it finds them
+        self.anytime = AnytimePortAssignment(self)
+        self.anytime.improved.connect(self.handle_anytime_ports)
+        self.anytime.finished.connect(self.handle_anytime_finished)
+        # Port assignment and layout after slider changes, once per burst of changes
+        self.recompute = RecomputeScheduler(self)
 
         root.addWidget(self.scroll_area)
         root.addWidget(self.canvas) 
@@ -115,7 +132,7 @@ class MainWindow(QMainWindow):
         self.hor_buttons.buttonClicked.connect(self.selection_mode_changed)
 
         # Color items representing each line 
-        self.group_list = GroupList(self.canvas, self.history_checkpoint, select_buttons=self.hor_buttons)
+        self.group_list = GroupList(self.canvas, self.history_checkpoint, select_buttons=self.hor_buttons, recompute=self.recompute)
         layout.addWidget(self.group_list)
         add_sidebar_button(layout, "Add Group", self.add_group_selection)
         add_sidebar_button(layout, "GO!", lambda: self.go_button_clicked())
@@ -147,6 +164,25 @@ class MainWindow(QMainWindow):
         self.add_slider(port_assign_box, "Label Horizontal Weight", 0, 200, 10, slider_set=3)
         self.add_slider(port_assign_box, "Label Same-Side Weight", 0, 100, 10, slider_set=3)
 
+        # Show the ports of the global method while it is still improving them, until accepted
+        self.anytime_ports = QCheckBox("Show intermediate ports")
+        self.anytime_ports.setChecked(False)
+        port_assign_box.addWidget(self.anytime_ports)
+        self.accept_ports = add_sidebar_button(port_assign_box, "Accept current ports", lambda: self.anytime.accept())
+        self.accept_ports.setEnabled(False)
+
+        # Solver of the port assignment and label ILPs, and how long one solve may take
+        self.ilp_backend = QComboBox()
+        self.ilp_backend.addItems(["SCIP", "CP-SAT (all cores)"])
+        self.ilp_backend.setCurrentIndex(port_assign.backends.index(port_assign.default_backend))
+        self.ilp_backend.currentIndexChanged.connect(self.ilp_backend_changed)
+        port_assign_box.addWidget(self.ilp_backend)
+        self.ilp_time_limit = QComboBox()
+        self.ilp_time_limit.addItems([ "No time limit" if limit is None else f"Time limit {limit} s" for limit in ilp_time_limits ])
+        self.ilp_time_limit.setCurrentIndex(ilp_time_limits.index(port_assign.ilp_time_limit))
+        self.ilp_time_limit.currentIndexChanged.connect(self.ilp_time_limit_changed)
+        port_assign_box.addWidget(self.ilp_time_limit)
+
         # Exectue chosen method 
         # add_sidebar_button(layout, "GO!", lambda: self.do_port_assign())
         
@@ -175,6 +211,29 @@ class MainWindow(QMainWindow):
         self.canvas.auto_update = QCheckBox("Auto-update")
         self.canvas.auto_update.setChecked(True)
         # layout_box.addWidget(self.canvas.auto_update)
+
+        # LP solver of the layout: the incremental GLOP model, or HiGHS on the sparse LP
+        # (with straight runs contracted and large components solved in parallel)
+        self.layout_backend = QComboBox()
+        self.layout_backend.addItems(["GLOP (incremental)", "HiGHS (sparse)"])
+        self.layout_backend.setCurrentIndex(self.layout_backend_index())
+        self.layout_backend.currentIndexChanged.connect(self.layout_backend_changed)
+        layout_box.addWidget(self.layout_backend)
+
+        # Solve the layout on a worker thread, newer requests supersede older ones
+        self.canvas.background_layout = QCheckBox("Solve in background")
+        self.canvas.background_layout.setChecked(True)
+        layout_box.addWidget(self.canvas.background_layout)
+
+        # Only re-solve the part of the layout around an edit, keeping the rest in place
+        self.canvas.local_layout = QCheckBox("Local re-layout")
+        self.canvas.local_layout.setChecked(False)
+        layout_box.addWidget(self.canvas.local_layout)
+
+        # Locked stations are constants in the layout, only the rest is solved for
+        self.canvas.fix_locked = QCheckBox("Keep locked stations in place")
+        self.canvas.fix_locked.setChecked(False)
+        layout_box.addWidget(self.canvas.fix_locked)
         # add_sidebar_button(layout, "Reset", lambda: self.do_reset_layout())
 
         # add_sidebar_button(layout_box, "GO!", lambda: self.go_button_clicked())
@@ -218,6 +277,19 @@ class MainWindow(QMainWindow):
         button.setChecked(True)
         self.canvas.selection_mode = [mode[0] for mode in self.selection_modes].index(button.property("mode"))
         
+    def ilp_backend_changed(self, index: int):
+        port_assign.default_backend = port_assign.backends[index]
+
+    def ilp_time_limit_changed(self, index: int):
+        port_assign.ilp_time_limit = ilp_time_limits[index]
+
+    def layout_backend_index(self) -> int:
+        return layout.backends.index(layout.default_backend)
+
+    def layout_backend_changed(self, index: int):
+        # Used from the next solve on, in the background as well
+        layout.default_backend = layout.backends[index]
+
     def dropdown_changed(self, index: int):
         # We add one because the first slider set is for general sliders 
         self.method_choice = index + 1
@@ -245,6 +317,8 @@ class MainWindow(QMainWindow):
         slider_index = len(self.sliders[slider_set])
         slider.valueChanged.connect(lambda x: self.update_slider_value(x, slider_set, slider_index, tick_size))
         slider.sliderReleased.connect(lambda: self.on_slider_release(text, slider_set))
+        if slider_set == 3: 
+            self.speculation.watch(slider, lambda: self.speculate(slider_set, slider_index, tick_size))
 
         layout.addWidget(slider)
         
@@ -259,23 +333,41 @@ class MainWindow(QMainWindow):
             if slider==0: 
                 for edge in self.canvas.network.edges: 
                     edge.min_dist = value * tick_size
-                self.do_layout()
+                self.recompute.request('layout', self.do_layout)
             if slider==1: 
                 self.canvas.label_dist = value * tick_size
-                self.do_layout()
+                if self.canvas.network.layout_set: 
+                    # Labels are not part of the layout LP, moving them needs no solve 
+                    layout.place_labels(self.canvas.network, self.canvas.label_dist)
+                    self.canvas.render()
+                else: 
+                    self.recompute.request('layout', self.do_layout)
         elif slider_set==3: 
-            if slider == 0: 
-                for node in self.canvas.network.nodes.values(): 
-                    node.bend_penalty = value * tick_size
-            if slider == 1: 
-                for node in self.canvas.network.nodes.values(): 
-                    node.label_hor = value * tick_size
-            if slider == 2: 
-                for node in self.canvas.network.nodes.values(): 
-                    node.label_same_side = value * tick_size
-            self.do_port_assign()
+            for node in self.canvas.network.nodes.values(): 
+                setattr(node, ilp_slider_attributes[slider], value * tick_size)
+            def recompute_ports(): 
+                # The neighbouring values are solved on the other cores while this one is
+                self.speculate(slider_set, slider, tick_size)
+                self.do_port_assign()
+            self.recompute.request('ports', recompute_ports)
         elif self.auto_update_port.isChecked(): 
-            self.do_port_assign()
+            self.recompute.request('ports', self.do_port_assign)
+
+    def speculate(self, slider_set: int, slider: int, tick_size=1): 
+        # Compute the port assignments for the values around the current one of a global (ILP) slider ahead
+        if slider_set != 3 or self.method_choice != 3: return 
+        _, widget = self.sliders[slider_set][slider]
+        attribute = ilp_slider_attributes[slider]
+
+        def state(value): 
+            def apply(net: Network): 
+                for node in net.nodes.values(): 
+                    setattr(node, attribute, value * tick_size)
+            return apply
+
+        values = range(widget.value() - speculation_radius, widget.value() + speculation_radius + 1)
+        states = [state(value) for value in values if value != widget.value() and widget.minimum() <= value <= widget.maximum()]
+        self.speculation.prefetch(self.canvas.network, states, self.canvas.auto_update.isChecked())
 
     def on_slider_release(self, text: str, slider_set: int): 
         if slider_set == 0: self.history_checkpoint(f"Altered layout by changing {text}")
@@ -305,10 +397,34 @@ class MainWindow(QMainWindow):
         self.canvas.render()
 
     def do_assign_ilp(self):
-        port_assign.assign_by_ilp(self.canvas.network)
+        status = None
+        if self.speculation.restore(self.canvas.network): pass
+        elif self.anytime_ports.isChecked(): 
+            # handle_anytime_ports takes it from here, for every assignment found
+            self.anytime.request(self.canvas.network)
+            self.accept_ports.setEnabled(True)
+            return 
+        else: status = port_assign.assign_by_ilp(self.canvas.network, hint=True)
+        self.update_layout_if_auto()
+        self.canvas.render()
+        if status is not None: 
+            model = self.canvas.network.port_model
+            self.canvas.report_ilp(status, "port assignment", model.gap if model is not None else None)
+
+    def handle_anytime_ports(self, job): 
+        # The network was replaced (opened file, undo) while solving 
+        if job.net is not self.canvas.network: return 
         self.update_layout_if_auto()
         self.canvas.render()
 
+    def handle_anytime_finished(self, job): 
+        self.accept_ports.setEnabled(False)
+        # Accepted by the user, or stopped at the time limit (with the best ports so far on the canvas)
+        if job.stopped or job.net is not self.canvas.network: return 
+        status = job.status
+        if job.objective is not None and status != port_assign.lp.Solver.OPTIMAL: status = port_assign.lp.Solver.FEASIBLE
+        self.canvas.report_ilp(status, "port assignment", job.gap)
+
     def do_zoom_to_fit(self):
         self.canvas.zoom_to_network()
         self.canvas.render()
@@ -323,22 +439,26 @@ class MainWindow(QMainWindow):
             self.do_layout()
 
     def do_layout(self):
-        if layout.layout_lp(self.canvas.network, label_dist=self.slider_values[0][1]) is False:
+        if self.canvas.background_layout.isChecked(): 
+            # handled by the canvas once the solve is done
+            self.canvas.request_layout()
+            return 
+
+        # Same scope as the background solve: local re-layout and locked stations kept in place
+        resolve_shift = layout.layout_lp(self.canvas.network, label_dist=self.slider_values[0][1], **self.canvas.layout_scope())
+        if resolve_shift is False:
             print( "user\t"+"Failed to realize layout.")
-            m = QMessageBox()
-            m.setText("Failed to realize layout.")
-            m.setIcon(QMessageBox.Warning)
-            m.setStandardButtons(QMessageBox.Ok)
-            m.exec()
-        else: 
-            self.canvas.network.layout_set = True 
-            if self.canvas.drawing_is_completely_oob():
-                self.canvas.zoom_to_network()
-                self.canvas.network.set_background_image()
-            self.canvas.render()
+        elif self.canvas.drawing_is_completely_oob():
+            self.canvas.zoom_to_network()
+            self.canvas.network.set_background_image()
+        # (reports a failure, also when the locked stations cannot stay in place)
+        self.canvas.handle_layout_result(resolve_shift, None)
+        self.canvas.render()
 
     def do_reset_layout(self):
         self.canvas.network.layout_set = False 
+        self.canvas.network.solved_blocks = None
+        self.canvas.network.layout_optimal = False
         for v in self.canvas.network.nodes.values():
             v.pos = v.geo_pos
         for e in self.canvas.network.edges:
@@ -348,16 +468,11 @@ class MainWindow(QMainWindow):
         self.canvas.render()
 
     def do_fix_label_overlap(self): 
-        success = port_assign.post_fix_overlap_ilp_new(self.canvas.network, self.slider_values[0][1])
-        if success: 
+        status = port_assign.post_fix_overlap_ilp_new(self.canvas.network, self.slider_values[0][1])
+        if port_assign.solution_found(status): 
             self.do_layout()
             self.history_checkpoint("Fix label overlap")
-        else: 
-            m = QMessageBox()
-            m.setText("Failed to realize layout without overlap.")
-            m.setIcon(QMessageBox.Warning)
-            m.setStandardButtons(QMessageBox.Ok)
-            m.exec()
+        self.canvas.report_ilp(status, "label overlap fix")
 
         ##### Brute force solution ######
         # overlaps = self.canvas.network.check_label_overlaps()
@@ -465,6 +580,17 @@ class MainWindow(QMainWindow):
             self.redo_action.setText( "Redo " + self.history[self.history_index+1][0] )
     
     def history_checkpoint(self, text):
+        # Store the state after the changes that are still waiting to be recomputed
+        self.recompute.flush()
+        if self.anytime.busy(): 
+            # The ports belonging to this change are still being improved, store the final ones instead
+            self.anytime.after_idle(lambda: self.history_checkpoint(text))
+            return 
+        if self.canvas.layout_service.busy(): 
+            # The layout belonging to this change is still being solved, store the result instead
+            self.canvas.layout_service.after_idle(lambda: self.history_checkpoint(text))
+            return 
+
         # Log the message
         print( "user\t"+text )
         # Delete the future
@@ -655,7 +781,7 @@ class GroupListItem(QWidget):
 
 class GroupList(QListWidget):
 
-    def __init__(self, canvas: Canvas, history_checkpoint, select_buttons, parent=None):
+    def __init__(self, canvas: Canvas, history_checkpoint, select_buttons, recompute: RecomputeScheduler, parent=None):
         super().__init__(parent)
         self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
         self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
@@ -670,6 +796,7 @@ class GroupList(QListWidget):
         self.history_checkpoint = history_checkpoint
         self.canvas = canvas 
         self.select_buttons = select_buttons
+        self.recompute = recompute
 
         self.items = {}
         self.current_id = None
@@ -779,12 +906,25 @@ class GroupList(QListWidget):
             case 0: self.canvas.groups[item_id].update_bend_penalty(value) 
             case 1: self.canvas.groups[item_id].update_hor_label(value) 
             case 2: self.canvas.groups[item_id].update_same_side_label(value) 
-            
-        port_assign.assign_by_ilp(self.canvas.network)
-        layout.layout_lp(self.canvas.network)
+        self.recompute.request(('group', item_id), lambda: self.recompute_group(item_id))
+
+    def recompute_group(self, item_id): 
+        # The group was removed while waiting
+        if item_id not in self.canvas.groups: return 
+
+        # Only the group's ports change with its sliders
+        status = port_assign.assign_by_ilp_group(self.canvas.network, self.canvas.groups[item_id])
+        if self.canvas.background_layout.isChecked(): 
+            # the canvas updates the group once the solve is done
+            self.canvas.request_layout()
+            self.canvas.report_ilp(status, "group port assignment")
+            return 
+        resolve_shift = layout.layout_lp(self.canvas.network, self.canvas.label_dist, **self.canvas.layout_scope())
+        self.canvas.handle_layout_result(resolve_shift, None)
 
         self.canvas.groups[item_id].update_group()
         self.canvas.render()
+        self.canvas.report_ilp(status, "group port assignment")
     
     def handle_slider_release(self, id): 
         if self.canvas.group: 
@@ -37,14 +37,24 @@ class Network:
 
         self.geo_min_max = (0, 0, 0, 0)
 
-        self.deg_2_lines: list[list[str]] = []
+        # Maximal degree 2 paths (see ChainIndex)
+        self.chains: ChainIndex = ChainIndex()
+
+        # The layout LP kept alive between solves (see helpers.layout.LayoutModel)
+        self.layout_model = None
+        # The port assignment ILP kept alive between solves (see helpers.port_assign.PortAssignmentModel)
+        self.port_model = None
+        # Constraint blocks of every edge and label the current layout was solved for (see helpers.layout.changed_nodes)
+        self.solved_blocks = None
+        # Whether the current layout is optimal for the whole network, and not only around an edit or with nodes
+        # kept in place (see helpers.layout.remember_layout)
+        self.layout_optimal: bool = False
 
     def clone(self):
         other = Network()
         other.midpoint = self.midpoint
         other.layout_set = self.layout_set
         other.geo_min_max = self.geo_min_max
-        other.deg_2_lines = self.deg_2_lines
         node_clones: dict[str, Node] = dict()
         for k,v in self.nodes.items():
             other_v = v.clone(v.pos.x(), v.pos.y(), v.name, v.label)
@@ -72,6 +82,7 @@ class Network:
             if e.port[0] is not None: a.ports[e.port[0]] = other_e
             if e.port[1] is not None: b.ports[e.port[1]] = other_e
 
+        other.chains = self.chains.clone(other.nodes)
         return other
 
     def scale_by_shortest_edge( self, lb ):
@@ -89,6 +100,19 @@ class Network:
         for v in self.nodes.values():
             v.evict_label()
 
+    def remove_edge(self, e: Edge): 
+        # Detach the edge from its ports and nodes, and walk the degree 2 paths at its ends again
+        for v in e.v: 
+            v.try_evict(e)
+            v.edges.remove(e)
+        self.edges.remove(e)
+        self.chains.update(e.v)
+
+    def remove_node(self, v: Node): 
+        for e in list(v.edges): self.remove_edge(e)
+        v.evict_label()
+        del self.nodes[v.name]
+
     def get_label_nodes(self): 
         node_labels: list[Node] = []
         for v in self.nodes.values():
@@ -98,10 +122,10 @@ class Network:
     def calculate_mid_point(self): 
         self.midpoint = midpoint([node.geo_pos for node in self.nodes.values()])
 
-        for line in self.deg_2_lines: 
-            midpoint_line: QPointF = midpoint([self.nodes[node_name].geo_pos for node_name in line])
-            for node_name in line: 
-                self.nodes[node_name].left_line = midpoint_line.x() <= self.midpoint.x()
+        for line in self.chains.at(): 
+            midpoint_line: QPointF = midpoint([node.geo_pos for node in line])
+            for node in line: 
+                node.left_line = midpoint_line.x() <= self.midpoint.x()
 
     # returns either two label vertices that overlap or one vertex that overlaps with an edge
     def check_label_overlaps(self): 
@@ -133,20 +157,7 @@ class Network:
         return self.edges_overlaps_label(rect) or self.labels_overlaps_label(rect)
 
     def find_degree_2_lines(self): 
-        self.deg_2_lines: list[list[str]] = []
-        seen: dict = dict()
-        for name, v in self.nodes.items(): 
-            if name in seen: continue
-
-            if len(v.edges) == 2:
-                seen[name] = True 
-
-                path1 = spacewalk( v.edges[0].other(v), v, seen )
-                path2 = spacewalk( v.edges[1].other(v), v, seen )
-                walk: list[Node] = [node.name for node in path1] + [v.name] + [v.name for v in reversed(path2)]
-                self.deg_2_lines.append(walk)
-            else: # We skip degree 1 and > 2 because they will be taken into account with one of the walks 
-                continue 
+        self.chains = ChainIndex(self.nodes.values())
 
     def find_min_max_geo(self): 
         min_x, min_y = math.inf, math.inf
@@ -425,6 +436,11 @@ class Label:
     
     def set_pos_by_port(self, p: int): 
         self.head = self.end + ((self.text_width + 20) * port_offset[p])
+
+    def place(self, label_dist: int): 
+        # Put the label at its port, label_dist away from the station 
+        head = self.node.pos + ((self.text_width + label_dist) * port_offset[self.port])
+        self.set_position( head.x(), head.y() )
     
     def set_position( self, x, y ):
         self.head = QPointF(x,y)
@@ -544,18 +560,104 @@ def midpoint(points: list[QPointF]):
         sum_y += v.y()
     return QPointF(sum_x / len(points), sum_y / len(points))
 
-def spacewalk( v: Node, prev, seen ) -> list[Node]:
-    seen[v.name] = True
-    walk = []
-    if v.is_deg2():
-        v0 = v.edges[0].other(v)
-        v1 = v.edges[1].other(v)
-        next = v0 if v1==prev else v1
-        # We want to add deg 1 and deg > 2 to the walk because they do belong to the part of the metro line
-        if next.is_deg2():
-            if not next.name in seen:
-                walk = spacewalk( next, v, seen )
-        else: 
-            walk.append(next)
-    walk.append(v)
-    return walk
+class ChainIndex:
+    """
+    Every maximal degree 2 path of a network, stored once: the nodes of the path in order, with the
+    first node that is not of degree 2 at both ends. A cycle of degree 2 nodes is stored closed (its
+    first node is repeated at the end).
+
+    The paths only depend on the edges, so a port change needs no update: the straight paths and the
+    paths inside a group are read off the stored ones with runs(). After edges are added or removed
+    (see Network.remove_edge), update() walks again only the paths through the touched nodes. A network
+    that is read or cloned gets an index of its own (Network.find_degree_2_lines, ChainIndex.clone).
+    """
+
+    def __init__(self, nodes=()):
+        self.chains: dict[int, list[Node]] = {}
+        # Degree 2 node -> its chain, end node -> the chains ending there
+        self.chain_of: dict[Node, int] = {}
+        self.ends: dict[Node, set[int]] = {}
+        self.next_id: int = 0
+        for v in nodes: self.add(v)
+
+    def clone(self, nodes: dict[str, Node]) -> ChainIndex:
+        other = ChainIndex()
+        for chain in self.chains.values():
+            other.insert([nodes[v.name] for v in chain])
+        return other
+
+    def trace(self, v: Node, e: Edge, start: Node) -> list[Node]:
+        # Nodes from v onward (entered through e) up to the first node not of degree 2, or up to start
+        path = []
+        while v is not start:
+            path.append(v)
+            if not v.is_deg2(): break
+            e = v.edges[0] if v.edges[1] is e else v.edges[1]
+            v = e.other(v)
+        return path
+
+    def add(self, v: Node):
+        if not v.is_deg2() or v in self.chain_of: return
+        e, f = v.edges
+        ahead = self.trace(e.other(v), e, v)
+        if ahead and ahead[-1].is_deg2(): # cycle
+            self.insert(list(reversed(ahead)) + [v, ahead[-1]])
+        else:
+            self.insert(list(reversed(ahead)) + [v] + self.trace(f.other(v), f, v))
+
+    def insert(self, chain: list[Node]):
+        id = self.next_id
+        self.next_id += 1
+        self.chains[id] = chain
+        for v in chain:
+            if v.is_deg2(): self.chain_of[v] = id
+            else: self.ends.setdefault(v, set()).add(id)
+
+    def remove(self, id: int) -> list[Node]:
+        chain = self.chains.pop(id)
+        for v in chain:
+            if self.chain_of.get(v) == id: del self.chain_of[v]
+            if id in self.ends.get(v, ()): self.ends[v].discard(id)
+        return chain
+
+    def update(self, nodes: list[Node]):
+        # The edges at these nodes changed: replace the chains through or ending at them
+        ids = set()
+        for v in nodes:
+            if v in self.chain_of: ids.add(self.chain_of[v])
+            ids |= self.ends.get(v, set())
+        touched = list(nodes)
+        for id in ids: touched += self.remove(id)
+        for v in touched: self.add(v)
+
+    def at(self, nodes=None) -> list[list[Node]]:
+        # The chains through or ending at any of the given nodes
+        if nodes is None: return list(self.chains.values())
+        ids = dict()
+        for v in nodes:
+            if v in self.chain_of: ids[self.chain_of[v]] = True
+            for id in sorted(self.ends.get(v, ())): ids[id] = True
+        return [self.chains[id] for id in ids]
+
+    def lines(self, nodes=None) -> list[list[Node]]:
+        # Copies of the chains (through any of the given nodes)
+        return [list(chain) for chain in self.at(nodes)]
+
+    def runs(self, inner, nodes=None) -> list[list[Node]]:
+        # Maximal sub paths of the chains whose inner nodes all satisfy inner(v), with their end points
+        runs = []
+        for chain in self.at(nodes):
+            if chain[0] is chain[-1] and len(chain) > 2: # cycle
+                broken = [i for i, v in enumerate(chain[:-1]) if not inner(v)]
+                if not broken:
+                    runs.append(list(chain))
+                    continue
+                chain = chain[broken[0]:-1] + chain[:broken[0]+1]
+            start = None
+            for i in range(1, len(chain)-1):
+                if inner(chain[i]):
+                    if start is None: start = i
+                    if not inner(chain[i+1]) or i+1 == len(chain)-1:
+                        runs.append(chain[start-1:i+2])
+                        start = None
+        return runs
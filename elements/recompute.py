@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+from time import perf_counter
+
+from PySide6.QtCore import QObject, QTimer
+
+# Wait for the parameters to stay put this long (ms) before recomputing, 0 to recompute right away
+recompute_delay = 60
+# but never let the drawing fall further behind than this (ms), so a long drag still shows its progress
+recompute_max_staleness = 250
+
+class RecomputeScheduler(QObject):
+    """
+    Coalesces bursts of parameter changes (a slider dragged across its range fires valueChanged for every
+    value) into one recomputation.
+
+    Changes take effect on the network right away, only the expensive work that follows them is requested
+    here, under a key per kind of work. A new request replaces the pending one with the same key, so the
+    work only ever runs once for the latest state. Pending work runs once no new request came in for the
+    delay, or once the oldest one has waited max_staleness, whichever comes first.
+    """
+
+    def __init__(self, parent=None, delay: int = None, max_staleness: int = None):
+        super().__init__(parent)
+        self.delay: int = recompute_delay if delay is None else delay
+        self.max_staleness: int = recompute_max_staleness if max_staleness is None else max_staleness
+        self.pending: dict[object, object] = {}
+        self.requests: int = 0
+        self.first: float | None = None
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.flush)
+
+    def request(self, key, work):
+        self.pending.pop(key, None)
+        self.pending[key] = work
+        self.requests += 1
+        if self.delay <= 0:
+            self.flush()
+            return
+        if self.first is None: self.first = perf_counter()
+        waited = int(1000*(perf_counter()-self.first))
+        self.timer.start( max(0, min(self.delay, self.max_staleness-waited)) )
+
+    def busy(self) -> bool:
+        return len(self.pending) > 0
+
+    def flush(self):
+        # Run the pending work now (e.g. when the slider is released)
+        self.timer.stop()
+        if not self.pending: return
+        if self.requests > len(self.pending):
+            print( "recompute\tSlider changes coalesced into one recomputation\t" + str(self.requests) )
+        pending, self.pending = self.pending, {}
+        self.requests, self.first = 0, None
+        for work in pending.values(): work()
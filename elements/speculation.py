@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from time import perf_counter
+
+from PySide6.QtCore import QObject, QEvent, Signal
+
+from elements.network import Network
+from helpers.layout import layout_cache
+from helpers.layout_sparse import network_problem, solve_components
+import helpers.port_assign as port_assign
+
+# Slider values on both sides of the current one that are computed ahead
+speculation_radius = 1
+# Port assignments kept for slider values that were computed ahead
+speculation_cache_size = 64
+# Leave one core for the GUI thread (the ILP solver releases the GIL while solving)
+speculation_workers = max(1, (os.cpu_count() or 2) - 1)
+
+def solver_clone( net: Network ) -> Network:
+    # A clone to solve on another thread, with the slider values the ILP reads (Network.clone leaves them out)
+    clone = net.clone()
+    for v, other in zip(net.nodes.values(), clone.nodes.values()):
+        other.bend_penalty = v.bend_penalty
+        other.label_hor = v.label_hor
+        other.label_same_side = v.label_same_side
+    return clone
+
+class SpeculativeJob:
+    """
+    Port assignment (and layout) for one slider value the user may move to next. base is a clone of the
+    network that no one changes anymore (see SpeculativePool.prefetch). The worker thread clones it again
+    and solves that clone, and the results are stored on the GUI thread.
+    """
+
+    def __init__(self, base: Network, apply, key: bytes, layout: bool):
+        self.base: Network = base
+        self.apply = apply
+        self.net: Network | None = None
+        self.key: bytes = key
+        self.layout: bool = layout
+        self.snapshot = None
+        self.ilp_status: int | None = None
+        self.problem = None
+        self.status: int | None = None
+        self.x = None
+
+    def run(self):
+        self.net = solver_clone(self.base)
+        self.apply(self.net)
+        self.ilp_status = port_assign.assign_by_ilp(self.net)
+        self.snapshot = port_assign.port_snapshot(self.net)
+        if self.layout and self.net.ports_set():
+            self.problem = network_problem(self.net)
+            self.status, self.x, _ = solve_components(self.problem, False)
+
+class SpeculativePool(QObject):
+    """
+    Precomputes port assignments for the slider values next to the current one on idle cores, so that
+    moving a slider there is served from cache instead of solving the ILP again.
+
+    The assignments are keyed by everything the ILP depends on (see port_assign.ilp_key), so they stay
+    valid until the network itself changes. When the layout is updated automatically the layout of each
+    assignment is solved as well and handed to the layout cache, where layout_lp finds it.
+    """
+    solved = Signal(object) # from a worker thread
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.executor = ThreadPoolExecutor(max_workers=speculation_workers)
+        self.assignments: OrderedDict[bytes, tuple[list, list]] = OrderedDict()
+        self.running: dict[bytes, tuple[SpeculativeJob, Future]] = {}
+        self.hover_callbacks: dict[QObject, object] = {}
+
+        self.solved.connect(self.handle_solved)
+
+    def watch(self, widget: QObject, callback):
+        # Call back when the mouse enters the widget (a slider about to be used)
+        self.hover_callbacks[widget] = callback
+        widget.installEventFilter(self)
+
+    def eventFilter(self, widget: QObject, event: QEvent) -> bool:
+        if event.type() == QEvent.Enter and widget in self.hover_callbacks:
+            self.hover_callbacks[widget]()
+        return False
+
+    def prefetch(self, net: Network, states: list, layout: bool):
+        # states: functions that each put a network into one of the slider states to compute
+        # Jobs for earlier states that did not start yet are not needed anymore
+        for key, (job, future) in list(self.running.items()):
+            if future.cancel(): del self.running[key]
+        # The only clone on the GUI thread: every state is put on it for its key, and the jobs clone it
+        # again on their worker once it is not changed anymore
+        base = solver_clone(net)
+        jobs = []
+        for apply in states:
+            apply(base)
+            key = port_assign.ilp_key(base)
+            if key in self.assignments or key in self.running or any( job.key == key for job in jobs ): continue
+            jobs.append(SpeculativeJob(base, apply, key, layout))
+        for job in jobs:
+            self.running[job.key] = (job, self.executor.submit(self.run, job))
+
+    def run(self, job: SpeculativeJob) -> SpeculativeJob:
+        try:
+            job.run()
+        except Exception as exception:
+            print( "stats\tspeculative port assignment raised " + repr(exception) )
+            job.snapshot = None
+        self.solved.emit(job)
+        return job
+
+    def handle_solved(self, job: SpeculativeJob):
+        if self.running.get(job.key, (None,))[0] is not job: return # already handled by restore
+        del self.running[job.key]
+        self.store(job)
+
+    def store(self, job: SpeculativeJob):
+        # Assignments cut short by the time limit are solved again when asked for, which reports them
+        if job.snapshot is None or job.ilp_status != port_assign.lp.Solver.OPTIMAL: return
+        self.assignments[job.key] = job.snapshot
+        self.assignments.move_to_end(job.key)
+        while len(self.assignments) > speculation_cache_size:
+            self.assignments.popitem(last=False)
+        if job.status == 0:
+            # layout_lp finds it there once the slider gets to this value
+            layout_cache.store( job.net, job.problem.position(job.x) )
+
+    def restore(self, net: Network) -> bool:
+        # Port assignment of net from cache, or from a job that is done but not handled yet. One that is
+        # still being computed is left to finish (handle_solved stores it), net is solved as usual.
+        start = perf_counter()
+        key = port_assign.ilp_key(net)
+        if key in self.running:
+            job, future = self.running[key]
+            if not future.done():
+                if future.cancel(): del self.running[key]
+                return False
+            del self.running[key]
+            self.store(future.result())
+        if key not in self.assignments: return False
+
+        self.assignments.move_to_end(key)
+        port_assign.restore_ports(net, self.assignments[key])
+        print( "pa-ilp\tPort assignment served from speculation (s)\t" + str(perf_counter()-start) )
+        return True
@@ -1,9 +1,14 @@
-from math import inf, sqrt, pi
+from math import inf, sqrt, pi, isnan
 from time import perf_counter
+from collections import OrderedDict
+from hashlib import blake2b
+
+import numpy as np
 
 from elements.network import *
 
 from ortools.linear_solver import pywraplp as lp
+from helpers.stats import record_model
 
 diag = 1/sqrt(2) # notational convenience
 
@@ -15,17 +20,52 @@ diag = 1/sqrt(2) # notational convenience
 bend_short = 0.5
 bend_long = 1
 
-def layout_lp( net: Network, label_dist:int = 20, stable_node:Node = None ):
+# Which LP solver layout_lp uses by default:
+# - 'glop': OR-Tools GLOP, built through linear expressions (incrementally by default)
+# - 'highs': HiGHS through scipy, built directly as sparse matrices (helpers/layout_sparse.py), with
+#   the chains of equal coordinates merged, straight runs contracted and components solved on their own
+# HiGHS is faster from scratch on every example; GLOP is ahead on small edits of some maps (wien, berlin,
+# nyc_subway) as it continues from the previous solve.
+default_backend = 'highs'
+backends = ['glop', 'highs']
+
+# How many edges away from an edit nodes may still move in a local re-layout
+region_hops = 3
+# Above this fraction of the nodes a local re-layout is not worth it and the whole layout is solved
+region_max_fraction = 0.5
+
+# Memory (in bytes) the cache of solved layouts may take; 0 turns it off
+layout_cache_bytes = 64 * 2**20
+
+def layout_lp( net: Network, label_dist:int = 20, stable_node:Node = None, incremental:bool = True, backend:str = None
+             , hops:int = None, region:list[Node] = None, fix_locked:bool = False ):
 
     if not net.ports_set(): return False
+
+    # A state we have solved before, or a rescaling of the current layout
+    shift = reuse_layout(net, label_dist, stable_node, fix_locked)
+    if shift is not False: return shift
+
+    if hops is not None or region is not None or fix_locked:
+        # Only move the nodes within hops of the edit (and the given region) and/or keep
+        # the locked nodes in place: the fixed nodes are constants in the LP
+        from helpers.layout_sparse import layout_local
+        return layout_local(net, label_dist, stable_node, hops, region, fix_locked)
+
+    if (backend or default_backend) == 'highs':
+        # Same LP, assembled as sparse matrices and solved by HiGHS in one call
+        from helpers.layout_sparse import layout_highs
+        return layout_highs(net, label_dist, stable_node)
+
+    if incremental:
+        # Reuse the LP of the previous solve (owned by the network) and only update what changed
+        if net.layout_model is None or net.layout_model.net is not net or net.layout_model.solving:
+            net.layout_model = LayoutModel(net)
+        return net.layout_model.solve(label_dist, stable_node)
     
     start = perf_counter()
     solver: lp.Solver = lp.Solver.CreateSolver('GLOP')
 
-    if stable_node:
-        # Track where the "stable node" was before
-        old_stable_pos = stable_node.pos
-
     objective = solver.Sum([])
     for v in net.nodes.values():
         v.xvar = solver.NumVar(0,solver.infinity(), v.name+'_x')
@@ -62,53 +102,38 @@ def layout_lp( net: Network, label_dist:int = 20, stable_node:Node = None ):
                     objective += edge_constraint_v2( solver, objective, e.v[1], e.port[1], e.bend, e.min_dist*bend_length( e, 1 ), e.max_dist )
 
 
-    for v in net.nodes.values(): 
-        v.label_node.xvar = solver.NumVar(0, solver.infinity(), v.name+'_label_x')
-        v.label_node.yvar = solver.NumVar(0, solver.infinity(), v.name+'_label_x')
-        if v.label_node.port != None: 
-            objective += edge_constraint( solver, objective, v, v.label_node.port, v.label_node, v.label_node.text_width + label_dist)
-
     # Space the stations on degree 2 paths
-    seen = dict()
-    for v in list(net.nodes.values()):
-        if v in seen: continue
-        if is_straight_deg2(v):
-            seen[id(v)] = True
-            path1 = spacewalk( v.edges[0].other(v), v, seen )
-            path2 = spacewalk( v.edges[1].other(v), v, seen )
-            walk = path1 + [v] + [v for v in reversed(path2)]
-            spacevar = solver.NumVar(0,solver.infinity(),name=f"{v.name}-spacer")
-            objective += spacevar
-            for a, b in zip(walk,walk[1:]):
-                solver.Add( a.xvar-b.xvar <= spacevar )
-                solver.Add( b.xvar-a.xvar <= spacevar )
-                solver.Add( a.yvar-b.yvar <= spacevar )
-                solver.Add( b.yvar-a.yvar <= spacevar )
+    for walk in straight_deg2_walks(net):
+        spacevar = solver.NumVar(0,solver.infinity(),name=f"{walk[0].name}-spacer")
+        objective += spacevar
+        for a, b in zip(walk,walk[1:]):
+            solver.Add( a.xvar-b.xvar <= spacevar )
+            solver.Add( b.xvar-a.xvar <= spacevar )
+            solver.Add( a.yvar-b.yvar <= spacevar )
+            solver.Add( b.yvar-a.yvar <= spacevar )
 
 
     # Solve the LP
     solver.Minimize( objective )
+    build = perf_counter()-start
     status = solver.Solve()
+    record_model( 'layout', build, perf_counter()-start-build, solver.NumVariables(), solver.NumConstraints(), status )
     if status==lp.Solver.OPTIMAL:
         runtime = perf_counter()-start
         print( "layout\tLayout LP runtime (s)\t" + str(runtime) )
         print( "Layout LP runtime",perf_counter()-start,"s")
 
-        net.layout_set = True 
+        def solution(p):
+            # A bend is a Node while solving, set_layout reduces it to a point
+            if isinstance(p, Edge): p = p.bend
+            if p is None: return None
+            return p.xvar.solution_value(), p.yvar.solution_value()
+        shift = set_layout( net, solution, label_dist, stable_node )
 
         for v in net.nodes.values():
-            v.set_position( v.xvar.solution_value(), v.yvar.solution_value() )
-            if v.label_node: v.label_node.set_position( v.label_node.xvar.solution_value(), v.label_node.yvar.solution_value() )
             del(v.xvar)
             del(v.yvar)
-
-        for e in net.edges:
-            if e.bend is not None:
-                # Bend was a Node for solving; reduce it to a point
-                e.bend = QPointF( e.bend.xvar.solution_value(), e.bend.yvar.solution_value() )
-
-        if stable_node is not None: return stable_node.pos - old_stable_pos
-        else: return None
+        return shift
     else:
         print( "stats\tlayout failed with status "+str(status))
         print(status)
@@ -123,41 +148,307 @@ def layout_lp( net: Network, label_dist:int = 20, stable_node:Node = None ):
         return False
 
 
-def edge_constraint( solver, objective, a, port, b, min_dist ):
-    match port:
-        case 0: # W
-            solver.Add( a.yvar == b.yvar )
-            solver.Add( b.xvar <= a.xvar - min_dist )
-            return a.xvar - b.xvar
-        case 1: # SW
-            solver.Add( a.xvar+a.yvar == b.xvar+b.yvar )
-            solver.Add( b.xvar <= a.xvar - diag*min_dist )
-            return 2*diag*a.xvar - 2*diag*b.xvar
-        case 2: # S
-            solver.Add( a.xvar == b.xvar )
-            solver.Add( b.yvar >= a.yvar + min_dist )
-            return b.yvar - a.yvar
-        case 3: # SE
-            solver.Add( a.xvar-a.yvar == b.xvar-b.yvar )
-            solver.Add( b.xvar >= a.xvar + diag*min_dist )
-            return 2*diag*b.xvar - 2*diag*a.xvar
-        case 4: # E
-            solver.Add( a.yvar == b.yvar )
-            solver.Add( b.xvar >= a.xvar + min_dist )
-            return b.xvar - a.xvar
-        case 5: # NE
-            solver.Add( a.xvar+a.yvar == b.xvar+b.yvar )
-            solver.Add( b.xvar >= a.xvar + diag*min_dist )
-            return 2*diag*b.xvar - 2*diag*a.xvar
-        case 6: # N
-            solver.Add( a.xvar == b.xvar )
-            solver.Add( b.yvar <= a.yvar - min_dist )
-            return a.yvar - b.yvar
-        case 7: # NW
-            solver.Add( a.xvar-a.yvar == b.xvar-b.yvar )
-            solver.Add( b.xvar <= a.xvar - diag*min_dist )
-            return 2*diag*a.xvar - 2*diag*b.xvar
-        
+def set_layout( net: Network, position, label_dist, stable_node:Node = None, old_stable_pos:QPointF = None
+              , optimal:bool = True ):
+    # Write a solved layout into the network. position maps a node or edge (its bend)
+    # to its solved coordinates, or to None if it was not part of the LP. Returns the shift of
+    # the stable node from old_stable_pos (by default where it is now), None without stable node.
+    # optimal is False for a layout solved with nodes kept in place (see remember_layout).
+    if stable_node is not None and old_stable_pos is None: old_stable_pos = stable_node.pos
+    net.layout_set = True
+
+    for v in net.nodes.values():
+        pos = position(v)
+        if pos is not None: v.set_position( *pos )
+
+    for e in net.edges:
+        bend = position(e)
+        e.bend = None if bend is None else QPointF( *bend )
+    place_labels(net, label_dist)
+    remember_layout(net, optimal)
+
+    if stable_node is not None: return stable_node.pos - old_stable_pos
+    else: return None
+
+def place_labels( net: Network, label_dist ):
+    # Labels do not constrain the stations, so they are not part of the LP: a label
+    # simply sits at its port, as close to its station as label_dist allows
+    for v in net.nodes.values():
+        if v.label_node.port is not None: v.label_node.place(label_dist)
+
+def remember_layout( net: Network, optimal: bool = True ):
+    # Store what the current layout was solved for, so that a later edit can be localized,
+    # and cache it so that returning to the same state does not need a solve. A layout with
+    # nodes kept in place is only optimal around the edit: it is neither cached nor rescaled,
+    # so that a solve of the whole network never gets it in place of the optimal layout.
+    net.solved_blocks = { e: edge_blocks(e) for e in net.edges }
+    net.layout_optimal = optimal
+    if optimal: layout_cache.store(net)
+
+def changed_nodes( net: Network ) -> set[Node] | None:
+    # Nodes with an edge that changed since the last solve, or None if the current
+    # layout was not solved for this network (never solved, reset, edges added)
+    if not net.layout_set or net.solved_blocks is None: return None
+    if len(net.solved_blocks) != len(net.edges): return None
+
+    changed = set()
+    for e in net.edges:
+        if e not in net.solved_blocks: return None
+        if net.solved_blocks[e] != edge_blocks(e): changed.update(e.v)
+    return changed
+
+def neighbourhood( nodes, hops: int ) -> set[Node]:
+    # The nodes at most hops edges away from the given nodes
+    region = set(nodes)
+    frontier = region
+    for _ in range(hops):
+        frontier = { u for v in frontier for u in v.neighbors() if u not in region }
+        region.update(frontier)
+    return region
+
+def reuse_layout( net: Network, label_dist, stable_node:Node = None, fix_locked:bool = False ):
+    # Layouts that follow without a solve: a state solved before (undo, toggling back, slider
+    # wiggling) or a uniform rescaling. Same return values as layout_lp, False if a solve is needed.
+    # Neither would keep locked nodes where they are.
+    if fix_locked and any( v.locked for v in net.nodes.values() ): return False
+    shift = layout_cache.restore(net, label_dist, stable_node)
+    if shift is False: shift = rescale_layout(net, label_dist, stable_node)
+    return shift
+
+def rescale_layout( net: Network, label_dist, stable_node:Node = None ):
+    # If every minimum length was scaled by the same factor since the last solve (the minimum edge
+    # distance slider) and no maximum lengths are set, the optimal layout is the current one scaled
+    # by that factor, as all constraints but x, y >= 0 are homogeneous. False if that is not the case
+    # (also if the current layout is not optimal, see remember_layout).
+    if not net.layout_set or not net.layout_optimal: return False
+    if net.solved_blocks is None or len(net.solved_blocks) != len(net.edges): return False
+
+    factor = None
+    for e in net.edges:
+        old = net.solved_blocks.get(e)
+        new = edge_blocks(e)
+        if old is None or len(old) != len(new): return False
+        for (a, port, b, old_min, old_max), (new_a, new_port, new_b, new_min, new_max) in zip(old, new):
+            if a is not new_a or port != new_port or b is not new_b: return False
+            if old_max is not None or new_max is not None: return False
+            if not old_min or not new_min:
+                if old_min != new_min: return False
+                continue
+            ratio = new_min/old_min
+            if factor is None: factor = ratio
+            elif abs(ratio-factor) > 1e-9*factor: return False
+    if factor is None or factor <= 0 or factor == 1: return False
+
+    position = { v: (v.pos.x()*factor, v.pos.y()*factor) for v in net.nodes.values() }
+    position.update( (e, (e.bend.x()*factor, e.bend.y()*factor)) for e in net.edges if e.bend is not None )
+    # Verify before using it: the blocks must hold for the scaled positions
+    for e in net.edges:
+        if not blocks_hold( edge_blocks(e), position ): return False
+
+    shift = set_layout( net, position.get, label_dist, stable_node )
+    print( "layout\tLayout rescaled by\t" + str(factor) )
+    return shift
+
+def blocks_hold( blocks, position, tolerance = 1e-6 ) -> bool:
+    # Whether the coordinates in position satisfy the constraint blocks (as from edge_blocks)
+    for a, port, b, min_dist, max_dist in blocks:
+        if a not in position or b not in position: return False
+        xy = position[a] + position[b]
+        eq, dist = port_templates[port]
+        scale = tolerance * (1 + max(abs(c) for c in xy))
+        if abs(sum( c*x for c, x in zip(eq, xy) )) > scale: return False
+        length = sum( c*x for c, x in zip(dist, xy) )
+        if min_dist is not None and length < min_dist - scale: return False
+        if max_dist is not None and length > max_dist + scale: return False
+    return True
+
+# Per port: coefficients over (a.x, a.y, b.x, b.y) of the octilinear equality (== 0)
+# and of the length of the edge from a to b, as in edge_constraint_v2
+port_templates = [ ( (0,1,0,-1),  (1,0,-1,0) )              # W
+                 , ( (1,1,-1,-1), (2*diag,0,-2*diag,0) )    # SW
+                 , ( (1,0,-1,0),  (0,-1,0,1) )              # S
+                 , ( (1,-1,-1,1), (-2*diag,0,2*diag,0) )    # SE
+                 , ( (0,1,0,-1),  (-1,0,1,0) )              # E
+                 , ( (1,1,-1,-1), (-2*diag,0,2*diag,0) )    # NE
+                 , ( (1,0,-1,0),  (0,1,0,-1) )              # N
+                 , ( (1,-1,-1,1), (2*diag,0,-2*diag,0) )    # NW
+                 ]
+
+def edge_blocks( e: Edge ) -> list[tuple]:
+    # The constraint blocks (from, port, to, min length, max length) of an edge, following layout_lp.
+    # A bent edge routes both ends to its bend point, which is represented by the edge itself.
+    if e.port[0] is None:
+        if e.port[1] is None: return []
+        return [ (e.v[1], e.port[1], e.v[0], e.min_dist, e.max_dist) ]
+    if e.port[1] is None or e.port[0]==opposite_port(e.port[1]):
+        return [ (e.v[0], e.port[0], e.v[1], e.min_dist, e.max_dist) ]
+    return [ (e.v[0], e.port[0], e, e.min_dist*bend_length( e, 0 ), e.max_dist)
+           , (e.v[1], e.port[1], e, e.min_dist*bend_length( e, 1 ), e.max_dist) ]
+
+class LayoutModel:
+    """
+    The layout LP of a network, kept alive between calls of layout_lp.
+
+    Every edge and straight degree 2 path owns a few rows of the LP. On a new solve only the rows
+    of the parts whose ports or lengths changed are rewritten (released rows are recycled), after which
+    GLOP continues from the basis of the previous solve instead of starting from scratch.
+
+    Unlike the sparse LP (helpers/layout_sparse.py), it does not contract straight runs of degree 2
+    stations (nor merge equal coordinates): a contracted run ties the rows of all its edges together,
+    so one port change along it would rewrite the whole run, which is what this model is there to avoid.
+    """
+
+    def __init__(self, net: Network):
+        self.net: Network = net
+        self.solver: lp.Solver = lp.Solver.CreateSolver('GLOP')
+        self.objective = self.solver.Objective()
+        self.objective.SetMinimization()
+        self.inf = self.solver.infinity()
+
+        # Node or (bent) Edge -> its coordinate variables
+        self.points: dict[Node | Edge, tuple] = {}
+        # Edge -> (blocks, rows, length terms)
+        self.blocks: dict[Edge, tuple] = {}
+        # Names along a straight degree 2 path -> (spacer variable, rows)
+        self.spacers: dict[tuple[str], tuple] = {}
+        # Objective coefficient per variable index
+        self.costs: dict[int, float] = {}
+
+        self.free_rows = []
+        self.free_spacers = []
+
+        # Between update and result of a solve on a worker thread (see elements.layout_service)
+        self.solving: bool = False
+
+    def solve(self, label_dist, stable_node: Node = None):
+        start = perf_counter()
+        changed = self.update()
+        build = perf_counter()-start
+        status = self.solver.Solve()
+        return self.result(status, start, build, changed, label_dist, stable_node)
+
+    def update(self) -> int:
+        # Rewrite the rows of the parts of the network that changed since the previous solve,
+        # returns how many parts changed
+        net = self.net
+        changed = 0
+        alive = set()
+        for e in net.edges:
+            changed += self.update_blocks( e, edge_blocks(e) )
+            alive.add(e)
+        for key in [key for key in self.blocks if key not in alive]:
+            # Edges that are no longer part of the network
+            self.release_blocks( self.blocks.pop(key) )
+        changed += self.update_spacers( straight_deg2_walks(net) )
+        return changed
+
+    def result(self, status: int, start: float, build: float, changed: int, label_dist
+              , stable_node: Node = None, old_stable_pos: QPointF = None):
+        # Write the solution of the solve started at start (after build seconds of updating changed parts)
+        # into the network. Same return values as layout_lp.
+        net = self.net
+        record_model( 'layout', build, perf_counter()-start-build, self.solver.NumVariables(), self.solver.NumConstraints(), status )
+        if status==lp.Solver.OPTIMAL:
+            runtime = perf_counter()-start
+            print( "layout\tLayout LP runtime (s)\t" + str(runtime) )
+            print( "Layout LP runtime",runtime,"s","(update",build,"s,",changed,"parts changed,",self.solver.iterations(),"iterations)")
+
+            return set_layout( net, self.solution, label_dist, stable_node, old_stable_pos )
+        else:
+            print( "stats\tlayout failed with status "+str(status))
+            print('INFEASIBLE', status==lp.Solver.INFEASIBLE)
+            for e in net.edges:
+                e.bend = None # clear bends
+            # Start from a fresh model next time
+            if net.layout_model is self: net.layout_model = None
+            return False
+
+    def solution(self, point):
+        # Only edges with a bend are currently part of the LP
+        if point in self.blocks and len(self.blocks[point][0]) != 2: return None
+        if point not in self.points: return None
+        x, y = self.points[point]
+        return x.solution_value(), y.solution_value()
+
+    def point(self, point):
+        if point not in self.points:
+            if isinstance(point, Edge): name = f"bend-{point.v[0].name}-{point.v[1].name}"
+            else: name = point.name
+            self.points[point] = ( self.solver.NumVar(0, self.inf, name+'_x'), self.solver.NumVar(0, self.inf, name+'_y') )
+        return self.points[point]
+
+    def row(self, lb, ub, terms):
+        ct = self.free_rows.pop() if self.free_rows else self.solver.Constraint(lb, ub)
+        ct.SetBounds(lb, ub)
+        for var, coef in terms:
+            if coef != 0: ct.SetCoefficient(var, coef)
+        return ct
+
+    def release_row(self, ct):
+        ct.Clear()
+        ct.SetBounds(-self.inf, self.inf)
+        self.free_rows.append(ct)
+
+    def add_costs(self, terms, sign=1):
+        for var, coef in terms:
+            cost = self.costs.get(var.index(), 0) + sign*coef
+            self.costs[var.index()] = cost
+            self.objective.SetCoefficient(var, cost)
+
+    def update_blocks(self, key, blocks) -> bool:
+        old = self.blocks.get(key)
+        if old is not None:
+            if old[0] == blocks: return False
+            self.release_blocks(old)
+
+        rows, terms = [], []
+        for a, port, b, min_dist, max_dist in blocks:
+            eq, dist = port_templates[port]
+            xy = self.point(a) + self.point(b)
+            dist_terms = list(zip(xy, dist))
+            rows.append( self.row(0, 0, zip(xy, eq)) )
+            if min_dist is not None: rows.append( self.row(min_dist, self.inf, dist_terms) )
+            if max_dist is not None: rows.append( self.row(-self.inf, max_dist, dist_terms) )
+            terms += dist_terms
+        self.add_costs(terms)
+        self.blocks[key] = (blocks, rows, terms)
+        return True
+
+    def release_blocks(self, old):
+        _, rows, terms = old
+        for ct in rows: self.release_row(ct)
+        self.add_costs(terms, -1)
+
+    def update_spacers(self, walks) -> int:
+        changed = 0
+        spacers = dict()
+        for walk in walks:
+            key = tuple(v.name for v in walk)
+            if key in self.spacers:
+                spacers[key] = self.spacers.pop(key)
+                continue
+            changed += 1
+            spacevar = self.free_spacers.pop() if self.free_spacers else self.solver.NumVar(0, self.inf, f"{walk[0].name}-spacer")
+            self.add_costs([(spacevar, 1)])
+            rows = []
+            for a, b in zip(walk, walk[1:]):
+                ax, ay = self.point(a)
+                bx, by = self.point(b)
+                rows.append( self.row(-self.inf, 0, [(ax,1), (bx,-1), (spacevar,-1)]) )
+                rows.append( self.row(-self.inf, 0, [(bx,1), (ax,-1), (spacevar,-1)]) )
+                rows.append( self.row(-self.inf, 0, [(ay,1), (by,-1), (spacevar,-1)]) )
+                rows.append( self.row(-self.inf, 0, [(by,1), (ay,-1), (spacevar,-1)]) )
+            spacers[key] = (spacevar, rows)
+
+        # Paths that were broken up or changed since the previous solve
+        for spacevar, rows in self.spacers.values():
+            changed += 1
+            for ct in rows: self.release_row(ct)
+            self.add_costs([(spacevar, 1)], -1)
+            self.free_spacers.append(spacevar)
+        self.spacers = spacers
+        return changed
+
 def edge_constraint_v2(solver, objective, a, port, b, min_dist=None, max_dist=None):
     match port:
         case 0:  # W
@@ -231,17 +522,69 @@ def is_straight_deg2(v: Node):
     if v.edges[0].port_at(v) == None or v.edges[1].port_at(v) == None: return False 
     return v.edges[0].port_at(v)==opposite_port(v.edges[1].port_at(v))
 
-def spacewalk( v, prev, seen ):
-    # Find maximal degree 2 path for spacer variable
-    seen[v] = True
-    walk = []
-    if is_straight_deg2(v):
-        # degree 2, straight through, no bends
-        v0 = v.edges[0].other(v)
-        v1 = v.edges[1].other(v)
-        next = v0 if v1==prev else v1
-        if not id(next) in seen:
-            walk = spacewalk( next, v, seen )
-    walk.append(v)
-    return walk
-        
+class LayoutCache:
+    """
+    Least recently used cache of solved layouts.
+
+    A layout only depends on the ports and lengths of the edges and on the ports the labels take up
+    (through the bend lengths), so these (with the names of the nodes) are hashed into the key. Entries
+    hold the node and bend coordinates; the oldest are dropped once max_bytes is exceeded.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes: int = max_bytes
+        self.bytes: int = 0
+        # key -> (node coordinates, bend coordinates)
+        self.entries: OrderedDict[bytes, tuple[np.ndarray, np.ndarray]] = OrderedDict()
+
+    def key(self, net: Network) -> bytes:
+        h = blake2b(digest_size=16)
+        for e in net.edges:
+            h.update(f"{e.v[0].name}\t{e.v[1].name}\t{e.port[0]}\t{e.port[1]}\t{e.min_dist}\t{e.max_dist}\n".encode())
+        for v in net.nodes.values():
+            h.update(f"{v.name}\t{v.label_node.port}\n".encode())
+        return h.digest()
+
+    def store(self, net: Network, position=None):
+        # Store the current layout of net, or the solved one given by position (as for set_layout)
+        if self.max_bytes <= 0: return
+        key = self.key(net)
+        if position is None:
+            nodes = [ (v.pos.x(), v.pos.y()) for v in net.nodes.values() ]
+            bends = [ (e.bend.x(), e.bend.y()) if e.bend is not None else (np.nan, np.nan) for e in net.edges ]
+        else:
+            nodes = [ position(v) or (v.pos.x(), v.pos.y()) for v in net.nodes.values() ]
+            bends = [ position(e) or (np.nan, np.nan) for e in net.edges ]
+        nodes = np.array(nodes, dtype=float).reshape(-1, 2)
+        bends = np.array(bends, dtype=float).reshape(-1, 2)
+
+        self.drop(key)
+        self.entries[key] = (nodes, bends)
+        self.bytes += nodes.nbytes + bends.nbytes
+        while self.bytes > self.max_bytes and self.entries:
+            self.drop(next(iter(self.entries)))
+
+    def drop(self, key: bytes):
+        if key in self.entries:
+            nodes, bends = self.entries.pop(key)
+            self.bytes -= nodes.nbytes + bends.nbytes
+
+    def restore(self, net: Network, label_dist, stable_node: Node = None):
+        # Put a cached layout in the network. Returns the shift of the stable node like layout_lp,
+        # or False if the layout is not in the cache.
+        if self.max_bytes <= 0: return False
+        key = self.key(net)
+        if key not in self.entries: return False
+        nodes, bends = self.entries[key]
+
+        position = dict(zip(net.nodes.values(), map(tuple, nodes.tolist())))
+        position.update( (e, (x, y)) for e, (x, y) in zip(net.edges, bends.tolist()) if not isnan(x) )
+        shift = set_layout( net, position.get, label_dist, stable_node )
+        print( "layout\tLayout restored from cache" )
+        return shift
+
+layout_cache = LayoutCache(layout_cache_bytes)
+
+def straight_deg2_walks( net: Network, nodes=None ) -> list[list[Node]]:
+    # Maximal straight degree 2 paths (including their end points), one spacer variable each
+    return net.chains.runs( is_straight_deg2, nodes )
@@ -0,0 +1,467 @@
+from __future__ import annotations
+
+import os
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+from scipy.optimize import linprog
+from scipy.sparse import coo_matrix, vstack
+from scipy.sparse.csgraph import connected_components
+
+from elements.network import *
+from helpers.layout import diag, port_templates, edge_blocks, straight_deg2_walks, set_layout
+from helpers.layout import changed_nodes, neighbourhood, region_max_fraction
+from helpers.stats import record_model
+
+### SPARSE LAYOUT LP ###
+# The layout LP of layout_lp, but assembled directly as (sparse) arrays: every constraint block
+# only contributes its port code, from which the rows follow by indexing the 8 direction templates.
+
+eq_templates = np.array([ eq for eq, _ in port_templates ], dtype=float)
+dist_templates = np.array([ dist for _, dist in port_templates ], dtype=float)
+
+# Solve the layout LP as a skeleton in which every straight run of degree 2 stations is
+# contracted into a single edge, and space the stations out along the runs afterwards (multilevel).
+# Local re-layouts contract the runs whose stations are all free. Only this backend contracts, see LayoutModel.
+contract_chains = True
+
+class LayoutProblem:
+    """
+    The layout LP of a network as plain arrays.
+
+    Points are nodes and bend points (an Edge stands for its bend point); the point with
+    index i has its x coordinate in column 2i and its y coordinate in column 2i+1, followed by one
+    column per spacer variable of a straight degree 2 path. Problems only hold arrays and the
+    list of points, so components of a problem (whose points are indices) can be sent to other processes.
+
+    In a contracted problem the inner stations of straight runs are left out: the run is a single
+    block, and its spacer pair spans several edges (see contract_walk).
+    """
+
+    def __init__(self, points: list, a, b, port, min_dist, max_dist, spacer_a, spacer_b, spacer, n_spacers: int, scope: set = None
+                , spacer_k = None, spacer_floor = None, chains: list = None):
+        self.points: list = points
+        self.index: dict = { p: i for i, p in enumerate(points) }
+        # The edges the problem was built from, None if all of them
+        self.scope: set[Edge] | None = scope
+
+        # One entry per constraint block
+        self.a: np.ndarray = a
+        self.b: np.ndarray = b
+        self.port: np.ndarray = port
+        self.min_dist: np.ndarray = min_dist
+        self.max_dist: np.ndarray = max_dist # nan if there is no maximum
+
+        # One entry per consecutive pair of stations on a straight degree 2 path
+        self.spacer_a: np.ndarray = spacer_a
+        self.spacer_b: np.ndarray = spacer_b
+        self.spacer: np.ndarray = spacer
+        self.n_spacers: int = n_spacers
+        # A pair spanning k edges only needs |a-b| <= k*spacer, and the spacer is at least its floor
+        self.spacer_k: np.ndarray = np.ones(len(spacer)) if spacer_k is None else spacer_k
+        self.spacer_floor: np.ndarray = np.zeros(len(spacer)) if spacer_floor is None else spacer_floor
+
+        # Contracted runs: (first point, port, last point, minimum lengths, inner stations)
+        self.chains: list[tuple] = chains or []
+
+    def num_vars(self) -> int:
+        return 2*len(self.points) + self.n_spacers
+
+    def num_constraints(self) -> int:
+        # Rows of matrices(): one equality per block, a row per minimum and maximum, four per spacer pair and the floors
+        floor = np.zeros(self.n_spacers)
+        np.maximum.at(floor, self.spacer, self.spacer_floor)
+        has_min = int((~np.isnan(self.min_dist)).sum())
+        has_max = int((~np.isnan(self.max_dist)).sum())
+        return len(self.port) + has_min + has_max + 4*len(self.spacer) + int((floor > 0).sum())
+
+    def matrices(self):
+        # Objective and constraints as: min c.x  s.t.  A_ub x <= b_ub,  A_eq x == b_eq,  x >= 0
+        n = self.num_vars()
+        k = len(self.port)
+
+        # Every block touches the columns (a.x, a.y, b.x, b.y)
+        rows = np.repeat(np.arange(k), 4)
+        cols = np.stack([ 2*self.a, 2*self.a+1, 2*self.b, 2*self.b+1 ], axis=1).ravel()
+        A_eq = coo_matrix( (eq_templates[self.port].ravel(), (rows, cols)), shape=(k, n) ).tocsr()
+        dist = coo_matrix( (dist_templates[self.port].ravel(), (rows, cols)), shape=(k, n) ).tocsr()
+        A_eq.eliminate_zeros()
+        dist.eliminate_zeros()
+
+        # Spacers: |a.x-b.x| <= s and |a.y-b.y| <= s, four rows per pair
+        m = len(self.spacer)
+        s = 2*len(self.points) + self.spacer
+        a, b = self.spacer_a, self.spacer_b
+        rows = np.repeat(np.arange(4*m), 3)
+        cols = np.stack([ 2*a, 2*b, s,  2*b, 2*a, s,  2*a+1, 2*b+1, s,  2*b+1, 2*a+1, s ], axis=1).ravel()
+        k_s = -self.spacer_k
+        data = np.stack([ np.ones(m), -np.ones(m), k_s ]*4, axis=1).ravel()
+        spacers = coo_matrix( (data, (rows, cols)), shape=(4*m, n) )
+        floor = np.zeros(self.n_spacers)
+        np.maximum.at(floor, self.spacer, self.spacer_floor)
+        has_floor = np.flatnonzero(floor > 0)
+        floors = coo_matrix( (-np.ones(len(has_floor)), (np.arange(len(has_floor)), 2*len(self.points)+has_floor)), shape=(len(has_floor), n) )
+
+        has_min = ~np.isnan(self.min_dist)
+        has_max = ~np.isnan(self.max_dist)
+        A_ub = vstack([ -dist[has_min], dist[has_max], spacers, floors ]).tocsr()
+        b_ub = np.concatenate([ -self.min_dist[has_min], self.max_dist[has_max], np.zeros(4*m), -floor[has_floor] ])
+
+        # Minimize the total edge length plus the spacers
+        c = np.asarray(dist.sum(axis=0)).ravel()
+        c[2*len(self.points):] += 1
+
+        return c, A_ub, b_ub, A_eq, np.zeros(k)
+
+    def components(self) -> list[tuple[LayoutProblem, np.ndarray, np.ndarray]]:
+        # Split into independent problems: points are only coupled through blocks and spacers.
+        # Returns every component with the indices of its points and of its spacers in this problem.
+        n = len(self.points)
+        a = np.concatenate([ self.a, self.spacer_a ])
+        b = np.concatenate([ self.b, self.spacer_b ])
+        graph = coo_matrix( (np.ones(len(a)), (a, b)), shape=(n, n) )
+        k, label = connected_components(graph, directed=False)
+        if k == 1: return [ (self, np.arange(n), np.arange(self.n_spacers)) ]
+
+        # Group points, blocks and spacer pairs by component
+        local = np.zeros(n, dtype=int)
+        point_groups = group_by(label, k)
+        for keep in point_groups: local[keep] = np.arange(len(keep))
+        block_groups = group_by(label[self.a], k)
+        pair_groups = group_by(label[self.spacer_a], k)
+
+        components = []
+        for keep, blocks, pairs in zip(point_groups, block_groups, pair_groups):
+            spacers, spacer = np.unique(self.spacer[pairs], return_inverse=True)
+            components.append(( LayoutProblem( list(keep), local[self.a[blocks]], local[self.b[blocks]], self.port[blocks]
+                                             , self.min_dist[blocks], self.max_dist[blocks]
+                                             , local[self.spacer_a[pairs]], local[self.spacer_b[pairs]], spacer.ravel(), len(spacers)
+                                             , spacer_k=self.spacer_k[pairs], spacer_floor=self.spacer_floor[pairs] )
+                              , keep, spacers ))
+        return components
+
+    def position(self, x: np.ndarray):
+        # Lookup of solved coordinates in the form set_layout expects
+        spaced = self.space_chains(x)
+        def lookup(p):
+            if p in spaced: return spaced[p]
+            if p not in self.index:
+                if isinstance(p, Edge) and self.scope is not None and p not in self.scope:
+                    # Edges outside the problem keep their bend
+                    return None if p.bend is None else (p.bend.x(), p.bend.y())
+                return None
+            i = self.index[p]
+            return float(x[2*i]), float(x[2*i+1])
+        return lookup
+
+    def space_chains(self, x: np.ndarray) -> dict[Node, tuple[float, float]]:
+        # Positions of the inner stations of contracted runs: as evenly spaced along the
+        # run as their minimum lengths allow, which fits the spacer of the full LP
+        spaced = dict()
+        for a, port, b, lengths, inner in self.chains:
+            start = x[2*a:2*a+2]
+            length = dist_templates[port] @ np.concatenate([ start, x[2*b:2*b+2] ])
+            step = np.array([ port_offset[port].x(), port_offset[port].y() ])
+            for v, along in zip(inner, np.cumsum(even_gaps(lengths, length))):
+                spaced[v] = tuple( float(c) for c in start + along*step )
+        return spaced
+
+def even_gaps( lengths: list[float], total: float ) -> np.ndarray:
+    # Gaps of at least the given lengths summing to total, with the largest gap as small as
+    # possible: every gap is max(length, level) for the level that makes them add up
+    lengths = np.asarray(lengths, dtype=float)
+    longest = np.sort(lengths)[::-1]
+    for j in range(len(lengths)):
+        # The j longest are at their minimum, the rest share what is left
+        level = (total - longest[:j].sum()) / (len(lengths) - j)
+        if level >= longest[j]: break
+    return np.maximum(lengths, level)
+
+def contract_walk( walk: list[Node], free: set[Node] = None ) -> tuple[list[tuple], list[tuple]]:
+    # Split a straight degree 2 path into maximal runs of straight edges in one direction. Returns
+    # the spacer pairs (a, b, edges spanned, floor) and, for the runs of 2 or more edges, the
+    # contracted blocks (a, port, b, minimum lengths, inner stations, edges) that replace them.
+    # A run can be solved as a single edge of the summed minimum length: its stations can then be
+    # spaced so that no gap exceeds length/k, nor the longest minimum length (the floor). With free,
+    # only those stations can be inside a run (the others are fixed where they are).
+    edges = []
+    for u, w in zip(walk, walk[1:]):
+        e = next( (e for e in u.edges if e.other(u) is w), None )
+        edges.append(e)
+    if None in edges or len(set(walk)) != len(walk): return [ (u, w, 1, 0) for u, w in zip(walk, walk[1:]) ], []
+
+    def direction(i):
+        # Port from walk[i] to walk[i+1] if that edge is straight (and has no maximum length)
+        blocks = edge_blocks(edges[i])
+        if len(blocks) != 1 or edges[i].max_dist is not None: return None
+        a, port, _, _, _ = blocks[0]
+        return port if a is walk[i] else opposite_port(port)
+
+    pairs, runs = [], []
+    i = 0
+    while i < len(edges):
+        port = direction(i)
+        j = i+1
+        while port is not None and j < len(edges) and direction(j) == port and (free is None or walk[j] in free): j += 1
+        if port is None or j-i == 1:
+            pairs.append( (walk[i], walk[i+1], 1, 0) )
+        else:
+            lengths = [ e.min_dist for e in edges[i:j] ]
+            # Gaps along a diagonal are diag times as long in x and y
+            floor = max(lengths) * (1 if port%2 == 0 else diag)
+            pairs.append( (walk[i], walk[j], j-i, floor) )
+            runs.append( (walk[i], port, walk[j], lengths, walk[i+1:j], edges[i:j]) )
+        i = j
+    return pairs, runs
+
+def network_problem( net: Network, region: set[Node] = None ) -> LayoutProblem:
+    # With a region, only the edges and degree 2 paths touching its nodes are included,
+    # so nodes outside the region only show up at its boundary. Straight runs are contracted
+    # if contract_chains is set, with a region only where the inner stations are in it.
+    if region is None:
+        nodes = list(net.nodes.values())
+        edges = net.edges
+        walks = straight_deg2_walks(net)
+    else:
+        nodes = [ v for v in net.nodes.values() if v in region ]
+        edges = [ e for e in net.edges if e.v[0] in region or e.v[1] in region ]
+        walks = [ walk for walk in straight_deg2_walks(net, region) if any( v in region for v in walk ) ]
+
+    pairs, runs = [], []
+    for s, walk in enumerate(walks):
+        if contract_chains:
+            walk_pairs, walk_runs = contract_walk(walk, region)
+            runs += walk_runs
+        else:
+            walk_pairs = [ (u, w, 1, 0) for u, w in zip(walk, walk[1:]) ]
+        pairs += [ (u, w, s, k, floor) for u, w, k, floor in walk_pairs ]
+    inner = { v for run in runs for v in run[4] }
+    contracted = { e for run in runs for e in run[5] }
+
+    points: list[Node | Edge] = [ v for v in nodes if v not in inner ]
+    index = { v: i for i, v in enumerate(points) }
+    def point(p):
+        if p not in index:
+            index[p] = len(points)
+            points.append(p)
+        return index[p]
+
+    blocks = []
+    for e in edges:
+        if e not in contracted: blocks += edge_blocks(e)
+    blocks += [ (a, port, b, sum(lengths), None) for a, port, b, lengths, _, _ in runs ]
+
+    return LayoutProblem( points
+                        , np.array([ point(a) for a, _, _, _, _ in blocks ], dtype=int)
+                        , np.array([ point(b) for _, _, b, _, _ in blocks ], dtype=int)
+                        , np.array([ port for _, port, _, _, _ in blocks ], dtype=int)
+                        , np.array([ min_dist for _, _, _, min_dist, _ in blocks ], dtype=float)
+                        , np.array([ max_dist for _, _, _, _, max_dist in blocks ], dtype=float) # None becomes nan
+                        , np.array([ point(u) for u, _, _, _, _ in pairs ], dtype=int)
+                        , np.array([ point(w) for _, w, _, _, _ in pairs ], dtype=int)
+                        , np.array([ s for _, _, s, _, _ in pairs ], dtype=int)
+                        , len(walks)
+                        , None if region is None else set(edges)
+                        , spacer_k=np.array([ k for _, _, _, k, _ in pairs ], dtype=float)
+                        , spacer_floor=np.array([ floor for _, _, _, _, floor in pairs ], dtype=float)
+                        , chains=[ (index[a], port, index[b], lengths, inner_nodes) for a, port, b, lengths, inner_nodes, _ in runs ] )
+
+def local_problem( net: Network, hops: int = None, region: list[Node] = None, fix_locked: bool = False ):
+    # The layout LP with some nodes fixed where they are: with hops or a region, all but the nodes
+    # within hops of the nodes changed since the last solve (and those in the region), and with
+    # fix_locked the locked nodes. Returns (problem, fixed, values) with the fixed points and their
+    # coordinates, or None if no node can be fixed (the edit cannot be localized, nothing is locked).
+    if not net.layout_set: return None
+    nodes = None
+    if hops is not None or region is not None:
+        changed = changed_nodes(net)
+        if changed:
+            nodes = neighbourhood(changed, hops or 0) | set(region or [])
+            if len(nodes) > region_max_fraction*len(net.nodes): nodes = None
+    if keeps_locked(net, fix_locked):
+        nodes = { v for v in (net.nodes.values() if nodes is None else nodes) if not v.locked }
+    if nodes is None: return None
+
+    # Only the parts touching the free nodes are needed
+    problem = network_problem(net, nodes)
+    fixed = np.array([ isinstance(p, Node) and p not in nodes for p in problem.points ], dtype=bool)
+    values = np.zeros((len(problem.points), 2))
+    for i in np.flatnonzero(fixed):
+        values[i] = problem.points[i].pos.x(), problem.points[i].pos.y()
+    return problem, fixed, values
+
+def keeps_locked( net: Network, fix_locked: bool ) -> bool:
+    # Whether a layout with fix_locked has locked nodes to keep in place
+    return fix_locked and any( v.locked for v in net.nodes.values() )
+
+def group_by( label: np.ndarray, k: int ) -> list[np.ndarray]:
+    # Indices of the entries with label 0, 1, ..., k-1
+    order = np.argsort(label, kind='stable')
+    return np.split(order, np.cumsum(np.bincount(label, minlength=k))[:-1])
+
+def solve_highs(c, A_ub, b_ub, A_eq, b_eq):
+    if A_eq.shape[0] == 0: A_eq, b_eq = None, None
+    return linprog(c, A_ub=A_ub, b_ub=b_ub, A_eq=A_eq, b_eq=b_eq, bounds=(0, None), method='highs')
+
+def substitute( c, A_ub, b_ub, A_eq, b_eq, cols: np.ndarray, values: np.ndarray ):
+    # Replace the variables in cols by constants. Returns the LP over the other variables together
+    # with their columns, or None if a row that is left without variables does not hold.
+    free = np.ones(len(c), dtype=bool)
+    free[cols] = False
+    b_ub = b_ub - A_ub[:, cols] @ values
+    b_eq = b_eq - A_eq[:, cols] @ values
+    A_ub = A_ub[:, free]
+    A_eq = A_eq[:, free]
+
+    live_ub = A_ub.getnnz(axis=1) > 0
+    live_eq = A_eq.getnnz(axis=1) > 0
+    tolerance = 1e-6 * (1 + np.abs(values).max(initial=0))
+    if (b_ub[~live_ub] < -tolerance).any() or (np.abs(b_eq[~live_eq]) > tolerance).any(): return None
+    return (c[free], A_ub[live_ub], b_ub[live_ub], A_eq[live_eq], b_eq[live_eq]), np.flatnonzero(free)
+
+def merge_equalities( c, A_ub, b_ub, A_eq, b_eq ):
+    # Presolve: an equality x_i - x_j == 0 (a horizontal edge equates the y coordinates of its ends,
+    # a vertical one the x coordinates) lets x_i and x_j share a column. Merges every such chain of
+    # equal variables into one. Returns the LP over the merged columns with the merged column of
+    # every original column, or None if a row that is left without variables does not hold.
+    A_eq = A_eq.tocsr()
+    rows = np.flatnonzero( (A_eq.getnnz(axis=1) == 2) & (b_eq == 0) )
+    first = A_eq.indptr[rows]
+    pairs = rows[ A_eq.data[first] == -A_eq.data[first+1] ]
+    n = len(c)
+    graph = coo_matrix( (np.ones(len(pairs)), (A_eq.indices[A_eq.indptr[pairs]], A_eq.indices[A_eq.indptr[pairs]+1])), shape=(n, n) )
+    k, column = connected_components(graph, directed=False)
+    if k == n: return (c, A_ub, b_ub, A_eq, b_eq), np.arange(n)
+
+    merge = coo_matrix( (np.ones(n), (np.arange(n), column)), shape=(n, k) ).tocsr()
+    A_ub = (A_ub @ merge).tocsr()
+    A_eq = (A_eq @ merge).tocsr()
+    A_ub.eliminate_zeros()
+    A_eq.eliminate_zeros()
+
+    # The merged equalities are now empty rows
+    live_ub = A_ub.getnnz(axis=1) > 0
+    live_eq = A_eq.getnnz(axis=1) > 0
+    if (b_ub[~live_ub] < 0).any() or (b_eq[~live_eq] != 0).any(): return None
+    return (merge.T @ c, A_ub[live_ub], b_ub[live_ub], A_eq[live_eq], b_eq[live_eq]), column
+
+def solve_lp( c, A_ub, b_ub, A_eq, b_eq ) -> tuple[int, np.ndarray]:
+    # Solve with equal variables merged, and expand the solution again
+    merged = merge_equalities(c, A_ub, b_ub, A_eq, b_eq)
+    if merged is None: return 2, None # infeasible
+    lp, column = merged
+    result = solve_highs(*lp)
+    if result.status != 0: return result.status, None
+    return 0, result.x[column]
+
+def solve_problem( problem: LayoutProblem, fixed: np.ndarray = None, values: np.ndarray = None ) -> tuple[int, np.ndarray]:
+    # Points marked in fixed are not solved for but stay at their coordinates in values
+    x = np.zeros(problem.num_vars())
+    if fixed is None or not fixed.any():
+        if len(problem.port) == 0:
+            # Nothing constrains these points (and nothing pulls them away from 0)
+            return 0, x
+        return solve_lp(*problem.matrices())
+
+    cols = np.flatnonzero(np.repeat(fixed, 2))
+    x[cols] = values[fixed].ravel()
+    reduced = substitute(*problem.matrices(), cols, x[cols])
+    if reduced is None: return 2, None # infeasible
+    lp, free = reduced
+    if len(free) == 0 or lp[1].shape[0] + lp[3].shape[0] == 0: return 0, x
+    status, free_x = solve_lp(*lp)
+    if status != 0: return status, None
+    x[free] = free_x
+    return 0, x
+
+### PARALLEL SOLVING OF COMPONENTS ###
+
+# Components with at least this many points are solved in the process pool, provided there
+# are several of them (e.g. a file with the networks of several cities); anything smaller is not
+# worth the round trip and is solved here. The round trip costs about 2 ms per component, HiGHS
+# takes some 15 ms for a component of 200 points.
+parallel_min_points = 200
+layout_pool: ProcessPoolExecutor | None = None
+
+def process_pool() -> ProcessPoolExecutor:
+    global layout_pool
+    if layout_pool is None:
+        # Spawn rather than fork: the GUI process has Qt threads running
+        layout_pool = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=get_context('spawn'))
+    return layout_pool
+
+def solve_components( problem: LayoutProblem, parallel: bool = True, fixed: np.ndarray = None, values: np.ndarray = None ) -> tuple[int, np.ndarray, int]:
+    # Solve every component on its own and stitch the solutions together. With fixed points the
+    # problem is solved as a whole: these are small, scattered problems where a solve per piece costs more.
+    components = problem.components() if fixed is None else [ (problem, np.arange(len(problem.points)), np.arange(problem.n_spacers)) ]
+    def fixed_in(keep):
+        return (None, None) if fixed is None else (fixed[keep], values[keep])
+    large = [ i for i, (sub, _, _) in enumerate(components) if len(sub.points) >= parallel_min_points ]
+    results = [None]*len(components)
+    if parallel and len(large) > 1:
+        futures = { i: process_pool().submit(solve_problem, components[i][0], *fixed_in(components[i][1])) for i in large }
+    else:
+        futures = dict()
+    for i, (sub, keep, _) in enumerate(components):
+        if i not in futures: results[i] = solve_problem(sub, *fixed_in(keep))
+    for i, future in futures.items():
+        results[i] = future.result()
+
+    x = np.zeros(problem.num_vars())
+    for (sub, keep, spacers), (status, sub_x) in zip(components, results):
+        if status != 0: return status, None, len(components)
+        n = len(sub.points)
+        x[2*keep] = sub_x[0:2*n:2]
+        x[2*keep+1] = sub_x[1:2*n:2]
+        x[2*len(problem.points) + spacers] = sub_x[2*n:]
+    return 0, x, len(components)
+
+def layout_highs( net: Network, label_dist:int = 20, stable_node:Node = None, parallel:bool = True ):
+    start = perf_counter()
+    problem = network_problem(net)
+    build = perf_counter()-start
+
+    status, x, components = solve_components(problem, parallel)
+    record_model( 'layout', build, perf_counter()-start-build, problem.num_vars(), problem.num_constraints(), status )
+    if status == 0:
+        runtime = perf_counter()-start
+        print( "layout\tLayout LP runtime (s)\t" + str(runtime) )
+        print( "Layout LP (HiGHS) runtime",runtime,"s","(build",build,"s,",problem.num_vars(),"variables,",components,"components)")
+        return set_layout( net, problem.position(x), label_dist, stable_node )
+    else:
+        print( "stats\tlayout failed with status "+str(status))
+        for e in net.edges:
+            e.bend = None # clear bends
+        return False
+
+def layout_local( net: Network, label_dist:int = 20, stable_node:Node = None, hops:int = None, region:list[Node] = None
+                , fix_locked:bool = False, parallel:bool = True ):
+    # Re-layout with nodes kept in place (see local_problem), falling back to the whole
+    # layout if no node can be kept in place or the remaining LP is infeasible. The locked
+    # nodes stay in place in the fallback too: if they cannot, the layout fails (returns
+    # False) and is left as it is.
+    start = perf_counter()
+    local = local_problem(net, hops, region, fix_locked)
+    if local is None: return layout_highs(net, label_dist, stable_node, parallel)
+    problem, fixed, values = local
+    build = perf_counter()-start
+
+    status, x, _ = solve_components(problem, parallel, fixed, values)
+    record_model( 'layout', build, perf_counter()-start-build, problem.num_vars(), problem.num_constraints(), status )
+    if status != 0:
+        if not keeps_locked(net, fix_locked):
+            print( "layout\tLocal layout failed with status "+str(status)+", solving the whole layout" )
+            return layout_highs(net, label_dist, stable_node, parallel)
+        if hops is not None or region is not None:
+            print( "layout\tLocal layout failed with status "+str(status)+", solving with only the locked nodes in place" )
+            return layout_local(net, label_dist, stable_node, fix_locked=True, parallel=parallel)
+        print( "layout\tLayout with the locked nodes in place failed with status "+str(status)+", keeping the current layout" )
+        return False
+
+    runtime = perf_counter()-start
+    free = sum( isinstance(p, Node) for p in problem.points ) - int(fixed.sum())
+    print( "layout\tLayout LP runtime (s)\t" + str(runtime) )
+    print( "Local layout LP runtime",runtime,"s","(",free,"of",len(net.nodes),"nodes free)")
+    return set_layout( net, problem.position(x), label_dist, stable_node, optimal=False )
@@ -1,5 +1,10 @@
+import os
 from math import pi
 from time import perf_counter
+from hashlib import blake2b
+
+from helpers.stats import record_model
+from helpers.port_trees import PortTrees, label_lines, infeasible
 
 from elements.network import *
 
@@ -9,60 +14,46 @@ from elements.group import Group
 
 import numpy as np
 
-def angle_error( a, b ):
-    diff = abs(a-b) % (2*pi)
-    return min(diff, 2*pi-diff)
-
-def cost_matrix( v: Node):
-    port_angles = [ i*(pi/4) for i in range(8) ]
-    edge_angles = [ e.geo_angle(v) for e in v.edges ]
-    return np.matrix( [ [ angle_error(pa,ea)**2 for pa in port_angles ] for ea in edge_angles ] )
+port_angles = np.array([ i*(pi/4) for i in range(8) ])
 
 # Two things to check for: 
 # - We give priority to labels that are horizontal so 0 and 4 and don't want 2 and 6 and for the odd numbers they should be equal
 # - We want labels that are on the outside to appear on the outside (either do this by a weighted middle point of the network or check whether labels point towards the outer face instead of an inner face)
-def cost_matrix_labels(v: Node, mid_point_x, old_node: Node): 
-    port_angles = [ i*(pi/4) for i in range(8) ]
-    edge_angles = []
-    for i,e in enumerate(v.edges): 
-        if old_node.locked: 
-            edge_angles.append(port_angles[old_node.edges[i].port_at(old_node)])
-        else: 
-            edge_angles.append(e.geo_angle(v))
-    # edge_angles = [ e.geo_angle(v) for e in v.edges ]
-    port_edge_matrix = np.matrix( [ [ angle_error(pa,ea)**2 for pa in port_angles ] for ea in edge_angles ] )
-    wl = [0.01 * v.label_hor, 0.02 * v.label_hor, 0.03 * v.label_hor]
-
-    ### Based on lines add weights for labels 
-
-    ### This is now commented out because of the feature (when dragging nodes are locked in place, but still the label positions I want to have fixed in place)
-    # if the node is locked we want to choose the port of the old label 
-    # if old_node.locked: 
-    #     label_weights = [1 for i in range(8)]
-    #     label_weights[old_node.label_node.port] = 0 
-    #     return np.vstack([port_edge_matrix, label_weights])
-
-    if len(v.edges) <= 2: 
-        return left_wm(port_edge_matrix, wl) if v.left_line else right_wm(port_edge_matrix, wl)
-    else : 
-        return left_wm(port_edge_matrix, wl) if v.geo_pos.x() <= mid_point_x else right_wm(port_edge_matrix, wl)
-
-    ### OLD
-    # if v.geo_pos.x() <= mid_point_x: 
-    #     return np.vstack([port_edge_matrix, np.array([wl[0] / 2, wl[1] /2 , wl[2], wl[1], wl[0], wl[1], wl[2], wl[1] / 2])])
-    # else: 
-    #     return np.vstack([port_edge_matrix, np.array([wl[0], wl[1], wl[2], wl[1] / 2, wl[0] / 2, wl[1] /2 , wl[2], wl[1]])])
-
-# Left weighted matrix 
-def left_wm(port_edge_matrix, wl): 
-    return np.vstack([port_edge_matrix, np.array([wl[0] / 2, wl[1] /2 , wl[2], wl[1], wl[0], wl[1], wl[2], wl[1] / 2])])
-
-# Right weighted matrix 
-def right_wm(port_edge_matrix, wl): 
-    return np.vstack([port_edge_matrix, np.array([wl[0], wl[1], wl[2], wl[1] / 2, wl[0] / 2, wl[1] /2 , wl[2], wl[1]])])
-
-def normal_wm(port_edge_matrix, wl): 
-    return np.vstack([port_edge_matrix, np.array([wl[0], wl[1], wl[2], wl[1], wl[0], wl[1] , wl[2], wl[1]])])
+# Label cost of port p is wl[label_weight[p]] / divisor[p] with wl = [0.01, 0.02, 0.03] * label_hor,
+# where the ports facing away from the middle of the network get half
+label_weight = [0, 1, 2, 1, 0, 1, 2, 1]
+left_divisor = np.array([2, 2, 1, 1, 1, 1, 1, 2])
+right_divisor = np.array([1, 1, 1, 2, 2, 2, 1, 1])
+
+def cost_matrices( nodes: list[Node], mid_point_x ) -> list[np.ndarray]:
+    # Cost matrix of every node in one pass: a row per edge with the squared angle error of each port
+    # to the geographic direction of the edge (or to its current port if the node is locked),
+    # followed by a row with the label costs per port
+    degree = np.array([ len(v.edges) for v in nodes ], dtype=int)
+
+    # Geographic angles of all (node, edge) incidences
+    edge_angles = np.array([ e.geo_angle(v) for v in nodes for e in v.edges ], dtype=float)
+
+    locked = np.repeat([ v.locked for v in nodes ], degree)
+    if locked.any():
+        edge_angles[locked] = port_angles[[ e.port_at(v) for v in nodes if v.locked for e in v.edges ]]
+
+    diff = np.abs(port_angles[None,:] - edge_angles[:,None]) % (2*pi)
+    edge_costs = np.minimum(diff, 2*pi-diff)**2
+
+    label_hor = np.array([ v.label_hor for v in nodes ], dtype=float)
+    wl = np.stack([ 0.01 * label_hor, 0.02 * label_hor, 0.03 * label_hor ], axis=1)
+    left = np.array([ v.left_line if len(v.edges) <= 2 else v.geo_pos.x() <= mid_point_x for v in nodes ], dtype=bool)
+    label_costs = wl[:, label_weight] / np.where(left[:,None], left_divisor, right_divisor)
+
+    # Interleave: the edge rows of a node followed by its label row
+    ends = np.cumsum(degree+1)
+    label_rows = ends-1
+    edge_rows = np.delete(np.arange(ends[-1] if len(ends) else 0), label_rows)
+    costs = np.empty((len(edge_rows)+len(label_rows), 8))
+    costs[edge_rows] = edge_costs
+    costs[label_rows] = label_costs
+    return np.split(costs, ends[:-1])
 
 ### ROUNDING ###
 
@@ -79,16 +70,63 @@ def assign_by_rounding( net: Network ):
 
 ### MATCHING ###
 
+from itertools import permutations
 from scipy.optimize import linear_sum_assignment
-def assign_by_local_matching( net: Network ):
-    net_clone = net.clone()
-    clone_nodes = list(net_clone.nodes.values())
+
+# Nodes with at most this many edges are matched all at once per degree, by trying every way to give
+# their edges and label distinct ports (8*7*6*5 = 1680 ways for 3 edges); larger ones one by one
+matching_table_degree = 3
+# Match the larger nodes in the process pool of the layout once there are this many of them
+parallel_min_matchings = 5000
+
+port_tables: dict[int, np.ndarray] = dict()
+
+def port_table( k: int ) -> np.ndarray:
+    # All ways to give k rows distinct ports, one per row
+    if k not in port_tables:
+        port_tables[k] = np.array(list(permutations(range(8), k)), dtype=int).reshape(-1, k)
+    return port_tables[k]
+
+def match_table( costs: np.ndarray ) -> np.ndarray:
+    # costs: (nodes, k, 8) cost matrices of nodes of the same size -> (nodes, k) ports
+    table = port_table(costs.shape[1])
+    totals = costs[:, np.arange(costs.shape[1])[None,:], table].sum(axis=2)
+    return table[totals.argmin(axis=1)]
+
+def match_each( all_costs: list[np.ndarray] ) -> list[np.ndarray]:
+    return [ linear_sum_assignment(costs)[1] for costs in all_costs ]
+
+def assign_by_local_matching( net: Network, parallel: bool = True ):
+    # Costs from the current ports (of locked nodes), before they are evicted
+    nodes = list(net.nodes.values())
+    all_costs = cost_matrices(nodes, net.midpoint.x())
     net.evict_all_labels()
     net.evict_all_edges()
-    for vi, v in enumerate(net.nodes.values()):
-        # Cost matrix for labels
-        costs = cost_matrix_labels(v, net.midpoint.x(), clone_nodes[vi])
-        _, cols = linear_sum_assignment(costs)
+
+    # Ports per node: a row per edge, and one for the label
+    ports: list[np.ndarray | None] = [None]*len(nodes)
+    by_degree: dict[int, list[int]] = dict()
+    for vi, v in enumerate(nodes):
+        by_degree.setdefault(len(v.edges), []).append(vi)
+    large = []
+    for degree, indices in by_degree.items():
+        if degree > matching_table_degree:
+            large += indices
+            continue
+        for vi, cols in zip(indices, match_table(np.stack([ all_costs[vi] for vi in indices ]))):
+            ports[vi] = cols
+    if parallel and len(large) >= parallel_min_matchings:
+        from helpers.layout_sparse import process_pool
+        chunk = -(-len(large) // (os.cpu_count() or 1))
+        chunks = [ large[i:i+chunk] for i in range(0, len(large), chunk) ]
+        results = process_pool().map(match_each, [ [ all_costs[vi] for vi in indices ] for indices in chunks ])
+        matched = [ cols for result in results for cols in result ]
+    else:
+        matched = match_each([ all_costs[vi] for vi in large ])
+    for vi, cols in zip(large, matched):
+        ports[vi] = cols
+
+    for v, cols in zip(nodes, ports):
         for i,p in enumerate(cols[:-1]):
             v.assign( v.edges[int(i)], int(p) )
 
@@ -101,27 +139,463 @@ def assign_by_local_matching( net: Network ):
 ### - Labels should appear on the same side of a line 
 
 from ortools.linear_solver import pywraplp as lp
-def assign_by_ilp( net: Network):
-    net_clone = net.clone()
-    clone_nodes = list(net_clone.nodes.values())
-    net.evict_all_labels()
-    net.evict_all_edges()
+from ortools.linear_solver import linear_solver_pb2
+from ortools.sat.python import cp_model
+
+# Solver of the port assignment and label ILPs: 'scip' (single threaded), or 'cp-sat' (on all cores)
+default_backend = 'scip'
+backends = ['scip', 'cp-sat']
+# Wall-clock budget of one ILP solve in seconds, or None to solve to optimality. When it runs out the best
+# assignment found so far is used, and the optimality gap is reported. The examples are all solved well
+# within it, but a bad instance would otherwise keep the editor waiting for as long as it takes.
+ilp_time_limit = 10
+
+def create_solver( backend: str = None ) -> lp.Solver:
+    if (backend or default_backend) == 'cp-sat':
+        solver = lp.Solver.CreateSolver("CP_SAT")
+        solver.SetNumThreads(os.cpu_count() or 1)
+        # The models are close to their LP relaxation, which CP-SAT only uses fully at this level
+        solver.SetSolverSpecificParametersAsString("linearization_level: 2")
+        return solver
+    return lp.Solver.CreateSolver("SCIP")
+
+def solve_ilp( solver: lp.Solver, name: str, time_limit: float = None ) -> tuple[int, float]:
+    # Solve within the time limit (ilp_time_limit if not given); returns the status and the gap between
+    # the objective of the solution and the best bound, relative to the objective (0 if optimal)
+    if time_limit is None: time_limit = ilp_time_limit
+    solver.SetTimeLimit( 0 if time_limit is None else int(time_limit*1000) ) # 0: no limit
+    status = solver.Solve()
+    if status != lp.Solver.FEASIBLE: return status, 0.0
+    value, bound = solver.Objective().Value(), solver.Objective().BestBound()
+    gap = abs(value-bound) / max(abs(value), 1e-9)
+    print( name + "\tILP stopped at the time limit with optimality gap\t" + str(gap) )
+    return status, gap
+
+def solution_found( status: int ) -> bool:
+    return status in (lp.Solver.OPTIMAL, lp.Solver.FEASIBLE)
+
+# Solve the trees outside the cyclic core of the network by dynamic programming (see helpers.port_trees),
+# so that only the core is left to the ILP
+tree_dp = True
+
+# Hand the current ports to SCIP as a starting solution. Off by default: the example networks are all
+# solved in the root node, where the hint hardly changes the runtime (benchmark.py reports both, as
+# ilp-resolve and ilp-hinted). The editor hints its re-solves (MainWindow.do_assign_ilp), so that a solve
+# stopped at ilp_time_limit still has the current ports to fall back on.
+ilp_hint = False
+
+def assign_by_ilp( net: Network, hint: bool = None, persistent: bool = True, backend: str = None ):
+    # With persistent, the model of the previous call (owned by the network) is solved again with
+    # new objective coefficients if the network still has the same nodes, edges and degree 2 lines
+    backend = backend or default_backend
+    if not persistent: return PortAssignmentModel(net, backend).solve(hint)
+    if net.port_model is None or not net.port_model.fits(net, backend) or net.port_model.solving:
+        net.port_model = PortAssignmentModel(net, backend)
+    return net.port_model.solve(hint)
+
+class PortAssignmentModel:
+    """
+    The port assignment ILP of a network, kept alive between calls of assign_by_ilp.
+
+    The variables and constraints only depend on the nodes, their edges and the degree 2 lines. The
+    sliders (bend_penalty, label_hor, label_same_side) and locked nodes only change the objective, so
+    a new solve rewrites the objective coefficients that changed and leaves the rest of the model alone.
+
+    With tree_dp the model only covers the cyclic core; the trees are solved before it on every solve
+    and add their costs to the edges that attach them to the core.
+    """
+
+    def __init__(self, net: Network, backend: str = None):
+        start = perf_counter()
+        self.net: Network = net
+        self.backend: str = backend or default_backend
+        self.tree_dp: bool = tree_dp
+        self.structure = self.structure_key(net)
+        # Rows of the edges and nodes in port_snapshot
+        self.edge_index: dict[Edge, int] = { e: i for i, e in enumerate(net.edges) }
+        self.node_index: dict[Node, int] = { v: i for i, v in enumerate(net.nodes.values()) }
+        self.trees: PortTrees | None = PortTrees(net) if tree_dp else None
+        nodes = [ v for v in net.nodes.values() if v in self.trees.core ] if tree_dp else list(net.nodes.values())
+        self.solver: lp.Solver = create_solver(self.backend)
+        self.objective = self.solver.Objective()
+        self.objective.SetMinimization()
+        solver = self.solver
+
+        # (node, edge) -> port variables at that end, where one block of variables is shared by both
+        # ends of an edge (at the far end the edge takes the opposite port)
+        self.portvars: dict[tuple[Node, Edge], list] = dict()
+        # Edge -> the end its variable block was created for
+        self.edge_ends: dict[Edge, Node] = dict()
+        self.portvars_labels: dict[Node, list] = dict()
+        self.bends: dict[Node, any] = dict()
+        # (a, b, p, penalty) for labels on a degree 2 line that are not on the same side
+        self.label_sides: list[tuple] = []
+        # Objective coefficient per variable index
+        self.costs: dict[int, float] = dict()
+        # Objective (trees included) and optimality gap of the last solve, None without a solution
+        self.value: float | None = None
+        self.gap: float | None = None
+        # Set by prepare, for the next run
+        self.tree_value: float = 0
+        self.changed: int = 0
+        self.hinted: int = 0
+        # Whether a solve runs on another thread (see elements.anytime), another solve needs a model of its own
+        self.solving: bool = False
+        # CP-SAT solver of a running ilp_incumbents
+        self.search: cp_model.CpSolver | None = None
+
+        for v in nodes:
+            for i,e in enumerate(v.edges):
+                if (e.other(v),e) in self.portvars: 
+                    other_portvars = self.portvars[(e.other(v),e)]
+                    my_portvars = [other_portvars[opposite_port(p)] for p in range(8)]
+                else: 
+                    # (at the core end of an edge to a tree)
+                    my_portvars = [solver.BoolVar(f'pass_{v.name}_{i}_{p}') for p in range(8)]
+                    # pick exactly one port for an edge
+                    solver.Add( solver.Sum(my_portvars)==1 )
+                    self.edge_ends[e] = v
+                self.portvars[(v,e)] = my_portvars
+        
+            #### For labeling ####
+            portvars_label = [solver.BoolVar(f'label_{v.name}_{p}') for p in range(8)]
+            # Pick one port for each label 
+            solver.Add( solver.Sum(portvars_label)==1 )
+            self.portvars_labels[v] = portvars_label
 
-    # bend cost is relative to squared angle errors
+            for p in range(8):
+                # assign at most one (edge or LABEL) to a port
+                solver.Add( solver.Sum([ self.portvars[(v,e)][p] for e in v.edges ] + [portvars_label[p]]) <= 1 )
+
+        # bend penalty
+        for v in nodes:
+            if len(v.edges)==2:
+                penalty = solver.BoolVar(f'bend_{v.name}')
+                e = v.edges[0]
+                f = v.edges[1]
+                for p in range(8):
+                    solver.Add( penalty >= self.portvars[(v,e)][p] - self.portvars[(v,f)][opposite_port(p)])
+                self.bends[v] = penalty
+
+        # labels on the same degree 2 line should be on the same side 
+        self.lines = label_lines(net)
+        for line in self.lines: 
+            # (a line is either part of the core or of a tree)
+            if line and line[0] not in self.portvars_labels: continue
+            for p in range(8): 
+                for a, b in zip(line, line[1:]): 
+                    penalty = solver.BoolVar(f'label_{a.name}_{b.name}')
+                    solver.Add( penalty >= self.portvars_labels[a][p] - self.portvars_labels[b][p])
+                    self.label_sides.append( (a, b, p, penalty) )
+        self.build = perf_counter()-start
+
+    @staticmethod
+    def structure_key( net: Network ) -> tuple:
+        return ( tuple( (v, tuple(v.edges)) for v in net.nodes.values() ), tuple(net.edges)
+               , tuple( tuple(line) for line in net.chains.lines() ) )
+
+    def fits(self, net: Network, backend: str) -> bool:
+        return ( self.net is net and self.backend == backend and self.tree_dp == tree_dp
+                 and self.structure == self.structure_key(net) )
+
+    def set_cost(self, var, cost) -> bool:
+        if self.costs.get(var.index()) == cost: return False
+        self.costs[var.index()] = cost
+        self.objective.SetCoefficient(var, cost)
+        return True
+
+    def solve(self, hint: bool = None, time_limit: float = None) -> int:
+        self.prepare(hint)
+        status = self.run(time_limit)
+        if solution_found(status):
+            self.assign(self.solution())
+        else:
+            print( 'Port assignment ILP infeasible' )
+            print( "stats\tPort assignment ILP infeasible" )
+            # Keep the ports we had (there may just not have been a solution within the time limit),
+            # and start from a fresh model next time
+            if self.net.port_model is self: self.net.port_model = None
+        return status
+
+    def prepare(self, hint: bool = None):
+        # Everything that reads the network: the costs, the trees and the hint. The solve itself (run)
+        # and reading its solution only touch the solver.
+        if hint is None: hint = ilp_hint
+        net = self.net
+        solver = self.solver
+        start = perf_counter()
+
+        # Costs from the current ports (of locked nodes)
+        nodes = list(net.nodes.values())
+        all_costs = cost_matrices(nodes, net.midpoint.x())
+        current_ports, current_labels = port_snapshot(net)
+
+        # The trees first: their cost by the port of the edge that attaches them to the core
+        edge_costs = { e: np.zeros(8) for e in self.edge_ends }
+        tree_value = 0
+        tree_start = perf_counter()
+        if self.trees is not None:
+            weights = dict()
+            for line in self.lines:
+                for a, b in zip(line, line[1:]):
+                    weights[(a,b)] = weights[(b,a)] = max(a.label_same_side, b.label_same_side)
+            costs_of = dict(zip(nodes, all_costs))
+            self.trees.solve( costs_of, weights )
+            for e, costs in self.trees.stub_costs( costs_of ).items():
+                edge_costs[e] += costs
+            tree_value = self.trees.value()
+            print( "pa-ilp\tPort assignment of trees by dynamic programming (s)\t" + str(perf_counter()-tree_start) )
+
+        # bend cost is relative to squared angle errors
+        changed = 0
+        for vi, v in enumerate(nodes):
+            if v not in self.portvars_labels: continue
+            costs = all_costs[vi]
+            for i,e in enumerate(v.edges):
+                if self.edge_ends[e] is v: edge_costs[e] += costs[i]
+                else: edge_costs[e] += costs[i][[opposite_port(p) for p in range(8)]]
+            for p in range(8):
+                changed += self.set_cost( self.portvars_labels[v][p], costs[len(costs)-1,p] )
+        for e, costs in edge_costs.items():
+            for p in range(8):
+                changed += self.set_cost( self.portvars[(self.edge_ends[e],e)][p], costs[p] )
+        for v, penalty in self.bends.items():
+            changed += self.set_cost( penalty, v.bend_penalty )
+        for a, b, p, penalty in self.label_sides:
+            changed += self.set_cost( penalty, max(a.label_same_side, b.label_same_side) )
+
+        # Hand the current ports to the solver, which completes a partial hint
+        # (edges without ports, or at ports that disagree)
+        hint_vars, hint_values = [], []
+        hinted_edges = set()
+        # An unchanged model still has its solution (and SCIP rejects a hint for it)
+        hint = hint and changed > 0
+        if hint:
+            for e, v in self.edge_ends.items():
+                port = current_ports[self.edge_index[e], e.id(v)]
+                if port >= 0 and current_ports[self.edge_index[e], 1-e.id(v)] == opposite_port(port):
+                    hinted_edges.add(e)
+                    hint_vars += self.portvars[(v,e)]
+                    hint_values += [ int(p == port) for p in range(8) ]
+            for v, port in zip(nodes, current_labels):
+                if port >= 0 and v in self.portvars_labels:
+                    hint_vars += self.portvars_labels[v]
+                    hint_values += [ int(p == port) for p in range(8) ]
+            for v, penalty in self.bends.items():
+                e, f = v.edges
+                if e in hinted_edges and f in hinted_edges:
+                    hint_vars.append(penalty)
+                    hint_values.append(int(current_ports[self.edge_index[e], e.id(v)]
+                                           != opposite_port(current_ports[self.edge_index[f], f.id(v)])))
+            for a, b, p, penalty in self.label_sides:
+                la, lb = current_labels[self.node_index[a]], current_labels[self.node_index[b]]
+                if la >= 0 and lb >= 0:
+                    hint_vars.append(penalty)
+                    hint_values.append(int(la == p and lb != p))
+        hinted = len(hinted_edges) + int(sum(current_labels[self.node_index[v]] >= 0 for v in self.portvars_labels)) if hint else 0
+        # (an empty hint clears the one of the previous solve)
+        solver.SetHint(hint_vars, hint_values)
+
+        self.tree_value, self.changed, self.hinted = tree_value, changed, hinted
+        # The first solve of a model includes building it
+        self.build += perf_counter()-start
+
+    def run(self, time_limit: float = None) -> int:
+        solver = self.solver
+        solve_start = perf_counter()
+        status, gap = solve_ilp(solver, 'pa-ilp', time_limit)
+        if self.tree_value >= infeasible: status = lp.Solver.INFEASIBLE
+        build, self.build = self.build, 0
+        runtime = build + perf_counter()-solve_start
+        objective = float(solver.Objective().Value() + self.tree_value) if solution_found(status) else None
+        self.value, self.gap = objective, gap if objective is not None else None
+        record_model( 'pa-ilp', build, runtime-build, solver.NumVariables(), solver.NumConstraints(), status
+                    , hinted=self.hinted, nodes=solver.nodes(), changed=self.changed, gap=gap, objective=objective
+                    , tree_nodes=len(self.trees.parent) if self.trees is not None else 0 )
+        print( "pa-ilp\tPort assignment ILP runtime (s)\t" + str(runtime) )
+        if self.hinted:
+            print( "pa-ilp\tPort assignment ILP hinted ports\t" + str(self.hinted) )
+            print( "pa-ilp\tPort assignment ILP branch-and-bound nodes with hint\t" + str(solver.nodes()) )
+        print( 'Port assignment ILP runtime', runtime, 's', '(' + str(self.changed), 'objective coefficients changed)' )
+        print( 'Solver status', status )
+        # Only the first of several runs after a prepare counts as changed and hinted
+        self.changed, self.hinted = 0, 0
+        return status
+
+    def solution(self, values: list[int] = None) -> tuple[list[int], list[int]]:
+        # Ports of the solution (or of values, per variable index), in the order of portvars and of portvars_labels
+        if values is None:
+            def port(x): return max(range(8), key=lambda p: x[p].solution_value())
+        else:
+            def port(x): return max(range(8), key=lambda p: values[x[p].index()])
+        return [ port(x) for x in self.portvars.values() ], [ port(x) for x in self.portvars_labels.values() ]
+
+    def assign(self, solution: tuple[list[int], list[int]]):
+        # Put a solution (from solution) on the network, and the trees along with it
+        net = self.net
+        edge_ports, label_ports = solution
+        net.evict_all_labels()
+        net.evict_all_edges()
+        for (v,e), p in zip(self.portvars, edge_ports):
+            v.assign(e,p)
 
-    solver: lp.Solver = lp.Solver.CreateSolver("SCIP")
+        # brute force simple port assignment
+        for v, p in zip(self.portvars_labels, label_ports): 
+            v.assign_label(p)
+            v.label_node.set_pos_by_port(p)
+        if self.trees is not None: self.trees.assign()
+
+    def restart(self, hint: list[float] = None):
+        # Set every objective coefficient again, so that the next run starts over instead of resuming a solve
+        # that stopped at its time limit, from hint (values of all variables, see hint_values) if given
+        for index, cost in self.costs.items():
+            self.objective.SetCoefficient(self.solver.variable(index), cost)
+        if hint is not None: self.solver.SetHint(self.solver.variables(), hint)
+
+    def hint_values(self) -> list[float]:
+        return [ x.solution_value() for x in self.solver.variables() ]
+
+    def interrupt(self):
+        # End a running solve early, from another thread
+        self.solver.InterruptSolve()
+        if self.search is not None: self.search.StopSearch()
+
+# Time limit of the first round of an anytime solve (s), every next round gets twice as long
+anytime_first_round = 0.1
+
+# Anytime port assignments are solved by CP-SAT, which reports every solution it finds as it goes
+# (ilp_incumbents), whatever the backend of the model. Without it they are solved in rounds on the solver
+# of the model (ilp_rounds), as pywraplp has no callback for new solutions.
+anytime_incumbents = True
+
+def ilp_anytime( model: PortAssignmentModel, incumbent, stopped=lambda: False ) -> int:
+    if anytime_incumbents: return ilp_incumbents(model, incumbent, stopped)
+    return ilp_rounds(model, incumbent, stopped)
+
+def cp_sat_model( solver: lp.Solver ) -> tuple[cp_model.CpModel, list]:
+    # The model of solver, with its objective and hint, as a CP-SAT model to solve with a solution callback.
+    # The port assignment models only have binary variables and integer constraint coefficients.
+    proto = linear_solver_pb2.MPModelProto()
+    solver.ExportModelToProto(proto)
+    model = cp_model.CpModel()
+    xs = [ model.NewBoolVar(v.name) for v in proto.variable ]
+    for c in proto.constraint:
+        expr = cp_model.LinearExpr.WeightedSum([ xs[i] for i in c.var_index ], [ int(a) for a in c.coefficient ])
+        if c.lower_bound == c.upper_bound: model.Add(expr == int(c.lower_bound))
+        else:
+            if c.lower_bound > -lp.Solver.infinity(): model.Add(expr >= int(np.ceil(c.lower_bound)))
+            if c.upper_bound < lp.Solver.infinity(): model.Add(expr <= int(np.floor(c.upper_bound)))
+    model.Minimize(cp_model.LinearExpr.WeightedSum(xs, [ v.objective_coefficient for v in proto.variable ])
+                   + proto.objective_offset)
+    for i, value in zip(proto.solution_hint.var_index, proto.solution_hint.var_value):
+        model.AddHint(xs[i], int(round(value)))
+    return model, xs
+
+class IncumbentCallback(cp_model.CpSolverSolutionCallback):
+    """
+    Hands every solution of a CP-SAT search (see ilp_incumbents) to incumbent, as ports of the model with
+    the objective of the trees added, and stops the search once stopped() is true.
+    """
+
+    def __init__(self, model: PortAssignmentModel, xs: list, incumbent, stopped):
+        super().__init__()
+        self.model, self.xs, self.incumbent, self.stopped = model, xs, incumbent, stopped
+        self.best: float | None = None
+        self.gap: float | None = None
+
+    def on_solution_callback(self):
+        if self.stopped():
+            self.StopSearch()
+            return
+        self.best = self.ObjectiveValue() + self.model.tree_value
+        bound = self.BestObjectiveBound() + self.model.tree_value
+        self.gap = abs(self.best-bound) / max(abs(self.best), 1e-9)
+        self.incumbent(self.model.solution([ self.Value(x) for x in self.xs ]), self.best, self.gap)
+
+def ilp_incumbents( model: PortAssignmentModel, incumbent, stopped=lambda: False ) -> int:
+    # Solves a prepared model (see PortAssignmentModel.prepare) with CP-SAT in one go, and calls
+    # incumbent(solution, objective, gap) for every solution CP-SAT finds on the way (see
+    # PortAssignmentModel.assign) until it is optimal, stopped() is true or ilp_time_limit has passed.
+    # Only touches the solver, so it can run on another thread while the network is in use.
+    # model.interrupt() ends the search early.
+    start = perf_counter()
+    if model.tree_value >= infeasible: return lp.Solver.INFEASIBLE
+    cp, xs = cp_sat_model(model.solver)
+    model.search = cp_model.CpSolver()
+    model.search.parameters.num_workers = os.cpu_count() or 1
+    model.search.parameters.linearization_level = 2
+    if ilp_time_limit is not None: model.search.parameters.max_time_in_seconds = ilp_time_limit
+    callback = IncumbentCallback(model, xs, incumbent, stopped)
+    result = model.search.Solve(cp, callback) if not stopped() else cp_model.UNKNOWN
+    model.search = None
+    status = { cp_model.OPTIMAL: lp.Solver.OPTIMAL, cp_model.FEASIBLE: lp.Solver.FEASIBLE
+             , cp_model.INFEASIBLE: lp.Solver.INFEASIBLE, cp_model.MODEL_INVALID: lp.Solver.ABNORMAL
+             }.get(result, lp.Solver.NOT_SOLVED)
+    model.value, model.gap = callback.best, 0.0 if status == lp.Solver.OPTIMAL else callback.gap
+    print( "pa-ilp\tAnytime port assignment runtime (s)\t" + str(perf_counter()-start) )
+    return status
+
+def ilp_rounds( model: PortAssignmentModel, incumbent, stopped=lambda: False ) -> int:
+    # Solves a prepared model (see PortAssignmentModel.prepare) in rounds of doubling time limits, each
+    # starting over from the best solution so far as hint: pywraplp has no callback for new solutions, and
+    # SCIP cannot resume a solve that stopped at its time limit. Only touches the solver, so it can run on
+    # another thread while the network is in use. Calls incumbent(solution, objective, gap) for every
+    # improvement (see PortAssignmentModel.assign) until the solution is optimal, stopped() is true or
+    # ilp_time_limit has passed. model.interrupt() ends the running round early.
+    start = perf_counter()
+    best = None
+    status, time_limit = lp.Solver.NOT_SOLVED, anytime_first_round
+    while not stopped():
+        status = model.run(time_limit)
+        # (a round that gets no further than its hint finds the same solution again, up to rounding)
+        if model.value is not None and (best is None or model.value < best - 1e-9*max(1, abs(best))):
+            best = model.value
+            hint = model.hint_values()
+            incumbent(model.solution(), best, model.gap)
+        if status not in (lp.Solver.FEASIBLE, lp.Solver.NOT_SOLVED): break
+        if ilp_time_limit is not None and perf_counter()-start >= ilp_time_limit: break
+        time_limit *= 2
+        model.restart(hint if best is not None else None)
+    if status != lp.Solver.OPTIMAL:
+        # Neither should the next solve resume where this one stopped
+        model.restart()
+    print( "pa-ilp\tAnytime port assignment runtime (s)\t" + str(perf_counter()-start) )
+    return status
+
+def assign_by_ilp_group( net: Network, group: Group, backend: str = None ):
+    # The port assignment ILP on the nodes of a group only: the rest of the network keeps its ports,
+    # and the edges that leave the group and the labels outside it are constants at their current ports
+    inside = set(group.nodes)
+    boundary = [ e for v in group.nodes for e in v.edges if e.other(v) not in inside ]
+    if any( None in e.port for v in group.nodes for e in v.edges ):
+        # No ports to start from yet
+        return assign_by_ilp(net, backend=backend)
+
+    solver: lp.Solver = create_solver(backend)
     start = perf_counter()
     objective = solver.Sum([])
     portvars = dict()
     portvars_labels = dict()
-    for vi, v in enumerate(net.nodes.values()):
-        costs = cost_matrix_labels(v, net.midpoint.x(), old_node=clone_nodes[vi])
+    def fixed( port ): return [ int(p == port) for p in range(8) ]
+
+    # bend cost is relative to squared angle errors
+    all_costs = cost_matrices(group.nodes, net.midpoint.x())
+    for vi, v in enumerate(group.nodes):
+        costs = all_costs[vi]
         for i,e in enumerate(v.edges):
-            my_portvars = [solver.BoolVar(f'pass_{v.name}_{i}_{p}') for p in range(8)]
+            if e.other(v) not in inside:
+                portvars[(v,e)] = fixed(e.port_at(v))
+                continue
+            if (e.other(v),e) in portvars: 
+                # One variable block per edge: at this end the edge takes the opposite port
+                other_portvars = portvars[(e.other(v),e)]
+                my_portvars = [other_portvars[opposite_port(p)] for p in range(8)]
+            else: 
+                my_portvars = [solver.BoolVar(f'pass_{v.name}_{i}_{p}') for p in range(8)]
+                # pick exactly one port for an edge
+                solver.Add( solver.Sum(my_portvars)==1 )
             for p in range(8):
                 objective += costs[i,p] * my_portvars[p]
-            # pick exactly one port for an edge
-            solver.Add( solver.Sum(my_portvars)==1 )
             portvars[(v,e)] = my_portvars
         
         #### For labeling ####
@@ -132,109 +606,108 @@ def assign_by_ilp( net: Network):
         solver.Add( solver.Sum(portvars_label)==1 )
         portvars_labels[v] = portvars_label
 
+    for v in group.nodes:
         for p in range(8):
             # assign at most one (edge or LABEL) to a port
-            solver.Add( solver.Sum([ portvars[(v,e)][p] for e in v.edges ] + [portvars_label[p]]) <= 1 )
-
-    # consistent port assignment by identifying opposite sides of the same edge
-    for e in net.edges:
-        for p in range(8):
-            solver.Add( portvars[(e.v[0],e)][p] == portvars[(e.v[1],e)][opposite_port(p)] )
+            solver.Add( solver.Sum([ portvars[(v,e)][p] for e in v.edges ] + [portvars_labels[v][p]]) <= 1 )
 
     # bend penalty
-    for v in net.nodes.values():
+    for v in group.nodes:
         if len(v.edges)==2:
-            penalty = solver.BoolVar(f'bend_{v.name}')
-            objective += v.bend_penalty*penalty
             e = v.edges[0]
             f = v.edges[1]
+            if e in boundary and f in boundary: continue
+            penalty = solver.BoolVar(f'bend_{v.name}')
+            objective += v.bend_penalty*penalty
             for p in range(8):
                 solver.Add( penalty >= portvars[(v,e)][p] - portvars[(v,f)][opposite_port(p)])
 
-    # labels on the same degree 2 line should be on the same side 
-    for line in net.deg_2_lines: 
-        if len(net.nodes[line[0]].edges) > 2: line.pop(0)
-        if len(net.nodes[line[len(line) - 1]].edges) > 2: line.pop(len(line) - 1)
+    # labels on the same degree 2 line should be on the same side (also next to a label outside the group)
+    for line in net.chains.lines(group.nodes): 
+        if len(line[0].edges) > 2: line.pop(0)
+        if len(line[len(line) - 1].edges) > 2: line.pop(len(line) - 1)
         for p in range(8): 
-            for a_name, b_name in zip(line, line[1:]): 
-                a, b = net.nodes[a_name], net.nodes[b_name]
+            for a, b in zip(line, line[1:]): 
+                if a not in inside and b not in inside: continue
+                label_a = portvars_labels[a][p] if a in inside else int(a.label_node.port == p)
+                label_b = portvars_labels[b][p] if b in inside else int(b.label_node.port == p)
                 penalty_strength = max(a.label_same_side, b.label_same_side)
-                penalty = solver.BoolVar(f'label_{a_name}_{b_name}')
+                penalty = solver.BoolVar(f'label_{a.name}_{b.name}')
                 objective += penalty_strength * penalty
-                solver.Add( penalty >= portvars_labels[a][p] - portvars_labels[b][p])
-                # solver.Add( penalty <= portvars_labels[a][p] - portvars_labels[b][p])
-
-    # # Labels on the same side
-    # seen = dict()
-    # for v in list(net.nodes.values()):
-    #     if v.name in seen: continue
-    #     if is_deg2(v):
-    #         seen[v.name] = True
-    #         path1 = spacewalk( v.edges[0].other(v), v, seen )
-    #         path2 = spacewalk( v.edges[1].other(v), v, seen )
-    #         walk = path1 + [v] + [v for v in reversed(path2)]
-    #         print([node.label for node in walk])
-    #         for a, b in zip(walk,walk[1:]): 
-    #             print(a.label, b.label)
-    #         # label same side 
-    #         for p in range(8): 
-    #             for a, b in zip(walk,walk[1:]):
-    #                 if a == b: continue 
-    #                 penalty = solver.BoolVar(f'label_{a.name}_{b.name}')
-    #                 objective += label_side_strength/10 * penalty
-    #                 solver.Add( penalty >= portvars_labels[a][p] - portvars_labels[b][p])
-    #                 # solver.Add( penalty <= portvars_labels[a][p] - portvars_labels[b][p])
+                solver.Add( penalty >= label_a - label_b)
 
     solver.Minimize(objective)
-    status = solver.Solve()
+    build = perf_counter()-start
+    status, gap = solve_ilp(solver, 'pa-ilp')
     runtime = perf_counter()-start
-    print( "pa-ilp\tPort assignment ILP runtime (s)\t" + str(runtime) )
-    print( 'Port assignment ILP runtime', runtime, 's' )
+    record_model( 'pa-ilp', build, runtime-build, solver.NumVariables(), solver.NumConstraints(), status, gap=gap )
+    print( "pa-ilp\tGroup port assignment ILP runtime (s)\t" + str(runtime) )
+    print( 'Group port assignment ILP runtime', runtime, 's', '(' + str(len(group.nodes)), 'of', len(net.nodes), 'nodes)' )
     print( 'Solver status', status )
-    if status==0:
-        net.evict_all_edges()
+    if solution_found(status):
+        for v in group.nodes:
+            v.evict_all(boundary)
         for (v,e), x in portvars.items():
+            if e in boundary: continue
             for p in range(8):
                 if x[p].solution_value()>0.5:
                     v.assign(e,p)
-
-        # brute force simple port assignment
         for v, x in portvars_labels.items(): 
             for p in range(8): 
                 if x[p].solution_value() > 0.5: 
                     v.assign_label(p)
                     v.label_node.set_pos_by_port(p)
-        # for v in net.nodes.values(): 
-        #     v.assign_label(v.first_free_port())
     else:
         print( 'Port assignment ILP infeasible' )
         print( "stats\tPort assignment ILP infeasible" )
+    return status
 
-def is_deg2(v: Node):
-    return len(v.edges)==2
-
-def spacewalk( v: Node, prev, seen ):
-    seen[v.name] = True
-    walk = []
-    if is_deg2(v):
-        v0 = v.edges[0].other(v)
-        v1 = v.edges[1].other(v)
-        next = v0 if v1==prev else v1
-        if not next.name in seen:
-            walk = spacewalk( next, v, seen )
-    walk.append(v)
-    return walk
-
-def post_fix_overlap_ilp_new(net: Network, label_dist):
+def ilp_key( net: Network ) -> bytes:
+    # Hash of everything assign_by_ilp depends on: the geography, the penalties, the degree 2 lines and
+    # the current ports of locked nodes. Networks with the same key get the same port assignment.
+    h = blake2b(digest_size=16)
+    h.update(repr(net.midpoint.x()).encode())
+    for v in net.nodes.values():
+        h.update(repr(( v.name, v.geo_pos.x(), v.geo_pos.y(), v.left_line, v.locked
+                      , v.bend_penalty, v.label_hor, v.label_same_side
+                      , [ (e.other(v).name, e.port_at(v) if v.locked else None) for e in v.edges ] )).encode())
+    for line in net.chains.at():
+        h.update(repr([ v.name for v in line ]).encode())
+    return h.digest()
+
+def port_snapshot( net: Network ) -> tuple[np.ndarray, np.ndarray]:
+    # Ports of the edges (at both ends) and labels, in the order of net.edges and net.nodes (which clones
+    # keep), -1 where there is none. Read-only: the solver and the speculation cache share them.
+    edge_ports = np.array([ -1 if p is None else p for e in net.edges for p in e.port ], dtype=np.int8).reshape(-1, 2)
+    label_ports = np.array([ -1 if v.label_node.port is None else v.label_node.port for v in net.nodes.values() ], dtype=np.int8)
+    edge_ports.flags.writeable = False
+    label_ports.flags.writeable = False
+    return edge_ports, label_ports
+
+def restore_ports( net: Network, snapshot: tuple[np.ndarray, np.ndarray] ):
+    # Put back ports taken with port_snapshot (from this network or a clone of it)
+    edge_ports, label_ports = snapshot
+    net.evict_all_labels()
+    net.evict_all_edges()
+    for e, ports in zip(net.edges, edge_ports.tolist()):
+        for v, p in zip(e.v, ports):
+            if p >= 0: v.assign(e,p)
+    for v, p in zip(net.nodes.values(), label_ports.tolist()):
+        if p >= 0:
+            v.assign_label(p)
+            v.label_node.set_pos_by_port(p)
+
+def post_fix_overlap_ilp_new(net: Network, label_dist, backend: str = None):
     
-    solver: lp.Solver = lp.Solver.CreateSolver("SCIP")
+    solver: lp.Solver = create_solver(backend)
 
     start_1 = perf_counter()
     objective = solver.Sum([])
     portvars_labels: dict[Node, dict[int, any]] = dict()
 
+    all_costs = cost_matrices(list(net.nodes.values()), net.midpoint.x())
     for vi, v in enumerate(net.nodes.values()):
-        costs = cost_matrix_labels(v, net.midpoint.x(), old_node=v)
+        costs = all_costs[vi]
 
         #### For labeling ####
         free_ports = v.get_free_ports()
@@ -287,12 +760,11 @@ def post_fix_overlap_ilp_new(net: Network, label_dist):
                     if rect_self.intersects(rect_other):
                         solver.Add(portvars_labels[v1][p_v1] + portvars_labels[v2][p_v2] <= 1)
 
-    for line in net.deg_2_lines: 
-        if len(net.nodes[line[0]].edges) > 2: line.pop(0)
-        if len(net.nodes[line[len(line) - 1]].edges) > 2: line.pop(len(line) - 1)
+    for line in net.chains.lines(): 
+        if len(line[0].edges) > 2: line.pop(0)
+        if len(line[len(line) - 1].edges) > 2: line.pop(len(line) - 1)
         for p in range(8): 
-            for a_name, b_name in zip(line, line[1:]): 
-                a, b = net.nodes[a_name], net.nodes[b_name]
+            for a, b in zip(line, line[1:]): 
                 penalty_strength = max(a.label_same_side, b.label_same_side)
                 penalty = solver.BoolVar(f'label_{a.name}_{b.name}')
                 objective += penalty_strength * penalty
@@ -316,34 +788,35 @@ def post_fix_overlap_ilp_new(net: Network, label_dist):
     print( "plf-calc\t Post-Label overlap fix pre-processing runtime\t" + str(runtime_p1) )
     
     solver.Minimize(objective)
-    status = solver.Solve()
+    status, gap = solve_ilp(solver, 'plf-ilp')
     runtime_p2 = perf_counter()-start_2
     total_runtime = perf_counter()-start_1
+    record_model( 'plf-ilp', runtime_p1, runtime_p2, solver.NumVariables(), solver.NumConstraints(), status, gap=gap )
     print( "plf-ilp\t Post-Label overlap fix ILP runtime (s)\t" + str(runtime_p2) )
     print( 'Post-Label overlap fix ILP runtime', total_runtime, 's' )
     print( 'Solver status', status )
-    if status==0:
+    if solution_found(status):
         for v, port_vars in portvars_labels.items(): 
             for p, port_var in port_vars.items():
                 if port_var.solution_value() > 0.5 and p != v.label_node.port: 
                     v.evict_label()
                     v.assign_label(p)
-        return True 
     else:
         print( 'Port assignment ILP infeasible' )
         print( "stats\tPort assignment ILP infeasible" )
-        return False
+    return status
 
-def post_fix_overlap_ilp_group(net: Network, label_dist, group: Group):
+def post_fix_overlap_ilp_group(net: Network, label_dist, group: Group, backend: str = None):
     
-    solver: lp.Solver = lp.Solver.CreateSolver("SCIP")
+    solver: lp.Solver = create_solver(backend)
 
     start_1 = perf_counter()
     objective = solver.Sum([])
     portvars_labels: dict[Node, dict[int, any]] = dict()
 
+    all_costs = cost_matrices(group.nodes, net.midpoint.x())
     for vi, v in enumerate(group.nodes):
-        costs = cost_matrix_labels(v, net.midpoint.x(), old_node=v)
+        costs = all_costs[vi]
 
         #### For labeling ####
         free_ports = v.get_free_ports()
@@ -430,13 +903,14 @@ def post_fix_overlap_ilp_group(net: Network, label_dist, group: Group):
     print( "plf-calc\t Post-Label overlap fix pre-processing runtime\t" + str(runtime_p1) )
     
     solver.Minimize(objective)
-    status = solver.Solve()
+    status, gap = solve_ilp(solver, 'plf-ilp')
     runtime_p2 = perf_counter()-start_2
     total_runtime = perf_counter()-start_1
+    record_model( 'plf-ilp', runtime_p1, runtime_p2, solver.NumVariables(), solver.NumConstraints(), status, gap=gap )
     print( "plf-ilp\t Post-Label overlap fix ILP runtime (s)\t" + str(runtime_p2) )
     print( 'Post-Label overlap fix ILP runtime', total_runtime, 's' )
     print( 'Solver status', status )
-    if status==0:
+    if solution_found(status):
         for v, port_vars in portvars_labels.items(): 
             for p, port_var in port_vars.items():
                 if port_var.solution_value() > 0.5 and p != v.label_node.port: 
@@ -445,6 +919,7 @@ def post_fix_overlap_ilp_group(net: Network, label_dist, group: Group):
     else:
         print( 'Port assignment ILP infeasible' )
         print( "stats\tPort assignment ILP infeasible" )
+    return status
 
 def post_fix_overlap_ilp_old(net: Network, label_dist): 
 
@@ -455,8 +930,9 @@ def post_fix_overlap_ilp_old(net: Network, label_dist):
     objective = solver.Sum([])
     portvars_labels = dict()
 
+    all_costs = cost_matrices(list(net.nodes.values()), net.midpoint.x())
     for vi, v in enumerate(net.nodes.values()):
-        costs = cost_matrix_labels(v, net.midpoint.x(), old_node=v)
+        costs = all_costs[vi]
 
         free_ports = v.get_free_ports() + [v.label_node.port]
         
@@ -514,8 +990,10 @@ def post_fix_overlap_ilp_old(net: Network, label_dist):
     #     candidates()
 
     solver.Minimize(objective)
+    build = perf_counter()-start
     status = solver.Solve()
     runtime = perf_counter()-start
+    record_model( 'pa-ilp', build, runtime-build, solver.NumVariables(), solver.NumConstraints(), status )
     print( "pa-ilp\tPort assignment ILP runtime (s)\t" + str(runtime) )
     print( 'Port assignment ILP runtime', runtime, 's' )
     print( 'Solver status', status )
@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from elements.network import *
+
+### PORT ASSIGNMENT OF TREES ###
+# Outside its cyclic core (the 2-core) a network consists of trees, either hanging off a core node or
+# forming a component of their own. On a tree the port assignment ILP is a chain of terms between a node
+# and its parent, which dynamic programming over the 8 ports solves exactly. A hanging tree then only
+# adds a cost per port to the edge that attaches it to the core, and the ILP is left with the core.
+
+# Port p at one end of an edge is port opposite[p] at the other end
+opposite = np.array([ opposite_port(p) for p in range(8) ])
+
+# Larger than any objective, smaller than what overflows when a few are added up
+infeasible = 1e30
+
+def label_lines( net: Network ) -> list[list[Node]]:
+    # The degree 2 lines along which consecutive labels should be on the same side (the ends of a
+    # line take part if they are not a junction)
+    lines = net.chains.lines()
+    for line in lines:
+        if len(line[0].edges) > 2: line.pop(0)
+        if len(line[len(line) - 1].edges) > 2: line.pop(len(line) - 1)
+    return lines
+
+class PortTrees:
+    """
+    The trees of a network outside its cyclic core, with the tables of the dynamic program over them.
+
+    Every tree node v has a parent edge (except the root of a component without a cycle, which is a leaf).
+    For the port q of the parent edge at v and the label port lp of the parent, table[v][q,lp] is the
+    cheapest assignment of the subtree of v: its labels, the edges below v, the bends and the labels that
+    are not on the same side as the one above them. The edge costs of the parent edge are not included.
+    """
+
+    def __init__(self, net: Network):
+        # Peel off leaves until only the 2-core is left
+        degree = { v: len(v.edges) for v in net.nodes.values() }
+        leaves = [ v for v, d in degree.items() if d <= 1 ]
+        peeled = set()
+        while leaves:
+            v = leaves.pop()
+            if v in peeled: continue
+            peeled.add(v)
+            for e in v.edges:
+                u = e.other(v)
+                if u in peeled: continue
+                degree[u] -= 1
+                if degree[u] <= 1: leaves.append(u)
+        self.core: set[Node] = set(net.nodes.values()) - peeled
+
+        # (core node, edge, tree node) for every tree that hangs off the core
+        self.stubs: list[tuple[Node, Edge, Node]] = []
+        # A leaf of every component without a cycle
+        self.roots: list[Node] = []
+        # Tree node -> its parent edge (None for roots) and (child, edge) below it
+        self.parent: dict[Node, Edge | None] = dict()
+        self.children: dict[Node, list[tuple[Node, Edge]]] = dict()
+        # Tree nodes, every node after its children
+        self.order: list[Node] = []
+
+        for r in self.core:
+            for e in r.edges:
+                if e.other(r) in peeled:
+                    self.stubs.append( (r, e, e.other(r)) )
+                    self.walk( e.other(r), e )
+        for v in net.nodes.values():
+            if v in peeled and v not in self.parent and len(v.edges) <= 1:
+                self.roots.append(v)
+                self.walk( v, None )
+
+        # Filled by solve
+        self.tables: dict[Node, np.ndarray] = dict()
+        self.label_choice: dict[Node, np.ndarray] = dict()
+        self.child_choice: dict[Node, object] = dict()
+
+    def walk(self, root: Node, edge: Edge | None):
+        # Parents and children of the tree below root (iteratively: trees can be long paths)
+        self.parent[root] = edge
+        stack, order = [root], []
+        while stack:
+            v = stack.pop()
+            order.append(v)
+            self.children[v] = []
+            for e in v.edges:
+                if e is self.parent[v]: continue
+                c = e.other(v)
+                self.parent[c] = e
+                self.children[v].append( (c, e) )
+                stack.append(c)
+        self.order += reversed(order)
+
+    def nodes(self) -> list[Node]:
+        return list(self.parent)
+
+    def solve(self, costs: dict[Node, np.ndarray], pair_weights: dict[tuple[Node, Node], float]):
+        # costs: cost matrix of every node (see port_assign.cost_matrices)
+        # pair_weights: same side penalty of consecutive labels, under (a, b) and (b, a)
+        for v in self.order:
+            self.solve_node( v, costs, pair_weights )
+
+    def solve_node(self, v: Node, costs: dict[Node, np.ndarray], pair_weights: dict):
+        cost = costs[v]
+        label = cost[-1]
+        children = self.children[v]
+        has_parent = self.parent[v] is not None
+        # Ports of the parent edge at v (a single row without parent)
+        parent_ports = np.arange(8) if has_parent else np.array([-1])
+
+        # Cost of every child for the port r of its edge at v and the label port l of v: [child][r,l]
+        below = []
+        for c, e in children:
+            below.append( cost[v.edges.index(e)][:,None] + costs[c][c.edges.index(e)][opposite][:,None]
+                        + self.tables[c][opposite,:] )
+
+        # best[q,l]: cheapest subtree with parent edge at port q and label at port l
+        taken = parent_ports[:,None] == np.arange(8)[None,:]
+        best = np.where(taken, infeasible, np.broadcast_to(label, taken.shape)).astype(float)
+        if len(children) == 1:
+            # [q,l,r]: a port can only be used once
+            ports = np.arange(8)
+            used = (ports[None,None,:] == parent_ports[:,None,None]) | (ports[None,None,:] == ports[None,:,None])
+            options = np.where(used, infeasible, below[0].T[None,:,:])
+            if has_parent and len(v.edges) == 2:
+                # bend unless the child edge leaves opposite to the parent edge
+                options += v.bend_penalty * (ports[None,None,:] != opposite[:,None,None])
+            choice = options.argmin(axis=2)
+            best += np.take_along_axis(options, choice[:,:,None], axis=2)[:,:,0]
+            self.child_choice[v] = choice
+        elif len(children) > 1:
+            # Junction: the children take distinct free ports (no bends, no label pairs)
+            choice = dict()
+            for qi, q in enumerate(parent_ports):
+                for l in range(8):
+                    if q == l: continue
+                    matrix = np.stack([ b[:,l] for b in below ])
+                    matrix[:, l] = infeasible
+                    if q >= 0: matrix[:, q] = infeasible
+                    rows, cols = linear_sum_assignment(matrix)
+                    best[qi,l] += matrix[rows, cols].sum()
+                    choice[(qi,l)] = cols
+            self.child_choice[v] = choice
+        best = np.minimum(best, infeasible)
+
+        # table[q,lp]: the label of v either at the parent's label port, or elsewhere at the pair penalty
+        weight = pair_weights.get( (self.parent[v].other(v), v), 0 ) if has_parent else 0
+        cheapest = best.argmin(axis=1)
+        elsewhere = best[np.arange(len(parent_ports)), cheapest] + weight
+        same = best < elsewhere[:,None]
+        self.tables[v] = np.where(same, best, elsewhere[:,None])
+        self.label_choice[v] = np.where(same, np.arange(8)[None,:], cheapest[:,None])
+
+    def stub_costs(self, costs: dict[Node, np.ndarray]) -> dict[Edge, np.ndarray]:
+        # Cost of each hanging tree by the port of its edge at the core node (the core end of the edge
+        # is part of the ILP). There is no label pair across a core node, so any parent label will do.
+        stubs = dict()
+        for r, e, c in self.stubs:
+            stubs[e] = costs[c][c.edges.index(e)][opposite] + self.tables[c][opposite,0]
+        return stubs
+
+    def value(self) -> float:
+        # Cost of the components without a cycle
+        return sum( self.tables[v][0].min() for v in self.roots )
+
+    def assign(self):
+        # Ports of the trees from the tables, once the core ports are assigned
+        for r, e, c in self.stubs:
+            c.assign(e, opposite_port(e.port_at(r)))
+        stack = [ (c, e.port_at(r), 0) for r, e, c in self.stubs ]
+        stack += [ (v, None, 0) for v in self.roots ]
+        while stack:
+            v, parent_port, parent_label = stack.pop()
+            qi = 0 if parent_port is None else opposite_port(parent_port)
+            l = int(self.label_choice[v][qi, parent_label])
+            v.assign_label(l)
+            v.label_node.set_pos_by_port(l)
+            children = self.children[v]
+            if len(children) == 1:
+                ports = [ self.child_choice[v][qi, l] ]
+            elif len(children) > 1:
+                ports = self.child_choice[v][(qi, l)]
+            else: ports = []
+            for (c, e), r in zip(children, ports):
+                v.assign(e, int(r))
+                c.assign(e, opposite_port(int(r)))
+                stack.append( (c, int(r), l) )
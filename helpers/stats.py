@@ -0,0 +1,15 @@
+import numpy as np
+
+# Size and timing of the most recent model of each solver, by the prefix of its stats line
+# ('pa-ilp', 'plf-ilp', 'layout'). The solvers print their stats lines as before; this is what
+# benchmark.py reads, since it cannot tell the model build from the solve in those lines.
+models: dict[str, dict] = {}
+
+def record_model( name: str, build: float, solve: float, variables: int, constraints: int, status: int, **details ):
+    # details: solver specific counts, e.g. how many ports the ILP was hinted with
+    models[name] = { key: plain(value) for key, value in
+        dict(build=build, solve=solve, variables=variables, constraints=constraints, status=status, **details).items() }
+
+def plain( value ):
+    # numpy scalars (e.g. counts taken from port snapshots) as Python numbers, so the models stay JSON serializable
+    return value.item() if isinstance(value, np.generic) else value
@@ -0,0 +1,13 @@
+import os
+import sys
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from PySide6.QtWidgets import QApplication
+
+@pytest.fixture(scope='session', autouse=True)
+def app():
+    # Labels are measured with Qt fonts
+    return QApplication.instance() or QApplication([])
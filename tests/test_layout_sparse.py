@@ -0,0 +1,129 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from benchmark import load
+import helpers.layout as layout
+import helpers.layout_sparse as layout_sparse
+import helpers.port_assign as port_assign
+
+examples = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'loom-examples')
+
+def two_copies(tmp_path, name: str):
+    # Two disjoint copies of an example in one file: a layout problem with two components of the same size
+    with open(os.path.join(examples, name + '.json')) as f: data = json.load(f)
+    copies = []
+    for feature in data['features']:
+        copy = json.loads(json.dumps(feature))
+        properties = copy['properties']
+        for key in ('id', 'from', 'to'):
+            if key in properties: properties[key] = 'copy' + properties[key]
+        if copy['geometry']['type'] == 'Point': copy['geometry']['coordinates'][0] += 1
+        else:
+            for point in copy['geometry']['coordinates']: point[0] += 1
+        copies.append(copy)
+    data['features'] += copies
+    file_name = tmp_path / 'two.json'
+    with open(file_name, 'w') as f: json.dump(data, f)
+    net = load(str(file_name))
+    port_assign.assign_by_local_matching(net, parallel=False)
+    return net
+
+@pytest.fixture
+def two_networks(tmp_path):
+    return two_copies(tmp_path, 'freiburg')
+
+def test_components_in_process_pool(two_networks, monkeypatch):
+    problem = layout_sparse.network_problem(two_networks)
+    sizes = [ len(sub.points) for sub, _, _ in problem.components() ]
+    assert len(sizes) == 2 and sizes[0] == sizes[1]
+
+    serial_status, serial_x, _ = layout_sparse.solve_components(problem, parallel=False)
+    submitted = []
+    pool = layout_sparse.process_pool()
+    monkeypatch.setattr(layout_sparse, 'parallel_min_points', 10)
+    monkeypatch.setattr(layout_sparse, 'process_pool', lambda: submitted.append(1) or pool)
+    status, x, components = layout_sparse.solve_components(problem, parallel=True)
+
+    assert len(submitted) == 2 and components == 2
+    assert serial_status == status == 0
+    np.testing.assert_allclose(x, serial_x)
+
+def test_components_fill_spacers(two_networks):
+    # The stitched solution (spacers included) is a solution of the whole LP, as good as solving it in one go
+    problem = layout_sparse.network_problem(two_networks)
+    status, x, components = layout_sparse.solve_components(problem, parallel=False)
+    assert status == 0 and components == 2 and problem.n_spacers > 0
+    spacers = x[2*len(problem.points):]
+    assert (spacers > 0).any()
+
+    c, A_ub, b_ub, A_eq, b_eq = problem.matrices()
+    assert (A_ub @ x <= b_ub + 1e-6).all()
+    np.testing.assert_allclose(A_eq @ x, b_eq, atol=1e-6)
+    whole_status, whole_x = layout_sparse.solve_lp(c, A_ub, b_ub, A_eq, b_eq)
+    assert whole_status == 0
+    assert c @ x == pytest.approx(c @ whole_x)
+
+def test_default_threshold(tmp_path, monkeypatch):
+    # Two copies of a large map in one file reach the pool without lowering parallel_min_points
+    problem = layout_sparse.network_problem(two_copies(tmp_path, 'london-tube'))
+    sizes = [ len(sub.points) for sub, _, _ in problem.components() ]
+    assert len(sizes) == 2 and min(sizes) >= layout_sparse.parallel_min_points
+
+    submitted = []
+    pool = layout_sparse.process_pool()
+    monkeypatch.setattr(layout_sparse, 'process_pool', lambda: submitted.append(1) or pool)
+    status, x, components = layout_sparse.solve_components(problem, parallel=True)
+    assert status == 0 and len(submitted) == 2
+
+def objective(problem, net) -> float:
+    # Objective of the (uncontracted) problem at the current layout, with every spacer as small as it can be
+    x = np.zeros(problem.num_vars())
+    for i, p in enumerate(problem.points):
+        pos = p.pos if isinstance(p, layout_sparse.Node) else p.bend
+        if pos is not None: x[2*i:2*i+2] = pos.x(), pos.y()
+    gaps = np.maximum(np.abs(x[2*problem.spacer_a] - x[2*problem.spacer_b]), np.abs(x[2*problem.spacer_a+1] - x[2*problem.spacer_b+1]))
+    spacers = np.zeros(problem.n_spacers)
+    np.maximum.at(spacers, problem.spacer, gaps)
+    x[2*len(problem.points):] = spacers
+    return problem.matrices()[0] @ x
+
+def test_local_contraction(monkeypatch):
+    # A local re-layout with the straight runs of its free stations contracted is as good (the stations
+    # inside a run may be spaced differently)
+    net = load(os.path.join(examples, 'wien.json'))
+    port_assign.assign_by_local_matching(net, parallel=False)
+    assert layout_sparse.layout_highs(net) is not False
+    blocks = net.solved_blocks
+    net.edges[len(net.edges)//2].min_dist += 30
+    start = { v: (v.pos.x(), v.pos.y()) for v in net.nodes.values() }
+    monkeypatch.setattr(layout_sparse, 'contract_chains', False)
+    full, _, _ = layout_sparse.local_problem(net, hops=3)
+
+    objectives, sizes = [], []
+    for contract in (False, True):
+        monkeypatch.setattr(layout_sparse, 'contract_chains', contract)
+        for v, (x, y) in start.items(): v.set_position(x, y)
+        net.solved_blocks = blocks
+        problem, _, _ = layout_sparse.local_problem(net, hops=3)
+        sizes.append(problem.num_vars())
+        assert layout_sparse.layout_local(net, hops=3) is not False
+        objectives.append(objective(full, net))
+    assert sizes[1] < sizes[0]
+    assert objectives[1] == pytest.approx(objectives[0])
+
+def test_local_layout_not_reused():
+    # A local re-layout is only optimal around the edit: scaling it (or taking it from the cache) in place
+    # of a solve of the whole network would keep it suboptimal
+    net = load(os.path.join(examples, 'wien.json'))
+    port_assign.assign_by_local_matching(net, parallel=False)
+    assert layout_sparse.layout_highs(net) is not False
+    assert net.layout_optimal
+    net.edges[len(net.edges)//3].min_dist += 30
+    assert layout_sparse.layout_local(net, hops=3) is not False
+    assert not net.layout_optimal
+    assert layout.layout_cache.restore(net, 20) is False
+    for e in net.edges: e.min_dist *= 2
+    assert layout.rescale_layout(net, 20) is False
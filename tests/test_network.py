@@ -0,0 +1,38 @@
+import os
+
+from benchmark import load
+from elements.network import ChainIndex
+from helpers.layout import is_straight_deg2
+import helpers.port_assign as port_assign
+
+examples = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'loom-examples')
+
+def paths(runs) -> set[tuple[str, ...]]:
+    # Runs by the names of their nodes, whichever way they were walked
+    return { min(tuple(v.name for v in run), tuple(v.name for v in reversed(run))) for run in runs }
+
+def assert_chains_current(net):
+    fresh = ChainIndex(net.nodes.values())
+    assert paths(net.chains.at()) == paths(fresh.at())
+    for inner in (lambda v: v.is_deg2(), is_straight_deg2):
+        assert paths(net.chains.runs(inner)) == paths(fresh.runs(inner))
+
+def test_chains_after_removal():
+    net = load(os.path.join(examples, 'wien.json'))
+    port_assign.assign_by_local_matching(net, parallel=False)
+    # An edge in the middle of a degree 2 path splits it
+    chain = max(net.chains.at(), key=len)
+    middle = chain[len(chain)//2]
+    before = len(net.chains.at())
+    net.remove_edge(middle.edges[0])
+    assert len(net.chains.at()) > before
+    assert_chains_current(net)
+
+    # A station where lines meet turns its neighbours into path ends or inner nodes
+    net.remove_node(max(net.nodes.values(), key=lambda v: len(v.edges)))
+    assert_chains_current(net)
+
+    # Ports only change the straight runs, which are read off the stored paths
+    net.evict_all_edges()
+    port_assign.assign_by_local_matching(net, parallel=False)
+    assert_chains_current(net)
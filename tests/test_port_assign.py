@@ -0,0 +1,46 @@
+import os
+
+import numpy as np
+import pytest
+
+from benchmark import load
+import helpers.layout_sparse as layout_sparse
+import helpers.port_assign as port_assign
+
+examples = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'loom-examples')
+
+def ports(net) -> list:
+    return [ (e.port[0], e.port[1]) for e in net.edges ] + [ v.label_node.port for v in net.nodes.values() ]
+
+@pytest.mark.parametrize('name', ['freiburg', 'wien'])
+def test_matching_in_process_pool(name, monkeypatch):
+    # Every node is matched on its own (no table) and, with a small threshold, in the process pool
+    monkeypatch.setattr(port_assign, 'matching_table_degree', 0)
+    net = load(os.path.join(examples, name + '.json'))
+    port_assign.assign_by_local_matching(net, parallel=False)
+    serial = ports(net)
+
+    submitted = []
+    pool = layout_sparse.process_pool()
+    monkeypatch.setattr(port_assign, 'parallel_min_matchings', 1)
+    monkeypatch.setattr(layout_sparse, 'process_pool', lambda: submitted.append(1) or pool)
+    port_assign.assign_by_local_matching(net, parallel=True)
+
+    assert submitted
+    assert ports(net) == serial
+    assert net.ports_set()
+
+def test_matching_table():
+    # The table of small nodes finds matchings as cheap as matching them one by one (ties may differ)
+    net = load(os.path.join(examples, 'wien.json'))
+    nodes = list(net.nodes.values())
+    all_costs = port_assign.cost_matrices(nodes, net.midpoint.x())
+    for degree in range(1, port_assign.matching_table_degree+1):
+        costs = [ c for v, c in zip(nodes, all_costs) if len(v.edges) == degree ]
+        if not costs: continue
+        table = port_assign.match_table(np.stack(costs))
+        each = port_assign.match_each(costs)
+        rows = np.arange(degree+1)
+        for c, a, b in zip(costs, table, each):
+            assert len(set(a)) == degree+1
+            assert c[rows, a].sum() == pytest.approx(c[rows, b].sum())